@@ -0,0 +1,16 @@
+import logging
+import os
+import random
+
+logging.basicConfig(level=logging.DEBUG, format='%(message)s')
+logger = logging.getLogger()
+
+r = random.Random()
+
+# Where the locustfiles configmap is mounted, holding the config, CSV and spreadsheet files the tests read
+LOCUSTFILE_DIRECTORY = '/mnt/locust/'
+respondents = int(os.getenv('test_respondents'))
+
+
+def respondent_email(respondent):
+    return f"499{respondent:08}@test.com"
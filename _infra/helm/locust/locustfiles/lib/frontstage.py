@@ -0,0 +1,394 @@
+import os
+import time
+from functools import partial
+from gevent.pool import Pool
+from gevent.queue import Queue
+from urllib3 import encode_multipart_formdata
+
+from locust import TaskSet, events
+from locust.clients import HttpSession
+from locust.event import EventHook
+from locust.contrib.fasthttp import FastHttpSession
+from locust.runners import MasterRunner, LocalRunner, WorkerRunner, STATE_MISSING
+
+from lib.config import logger, r, respondent_email, respondents
+from lib.histograms import record_corrected_latency
+from lib.pages import HtmlPage, capture_csrf_token
+from lib.phases import start_phases
+from lib.seed import prepare_data
+
+# USER_WAIT_TIME_WAIT_TIME is between GET and POST requests
+USER_WAIT_TIME_MIN_SECONDS = int(os.getenv('user_wait_time_min_seconds', 5))
+USER_WAIT_TIME_MAX_SECONDS = int(os.getenv('user_wait_time_max_seconds', 15))
+# With pacing_mode 'think_time' users sleep a sampled think time after each request, so offered load drops whenever
+# frontstage slows down. 'constant' instead starts each request (pacing_unit 'request') or journey ('iteration') at
+# target_rate per second, either per user or shared between all users (pacing_scope 'global'), and records
+# coordinated-omission-corrected latency alongside the raw figures in rasrm_corrected_latency.csv
+PACING_MODE = os.getenv('pacing_mode', 'think_time')
+PACING_UNIT = os.getenv('pacing_unit', 'iteration')
+PACING_SCOPE = os.getenv('pacing_scope', 'user')
+TARGET_RATE = float(os.getenv('target_rate', 1))
+# Distribution of think times, and of the gaps between paced starts: uniform, exponential, pareto or constant
+THINK_TIME_DISTRIBUTION = os.getenv('think_time_distribution', 'uniform')
+THINK_TIME_PARETO_SHAPE = float(os.getenv('think_time_pareto_shape', 2.5))
+if THINK_TIME_DISTRIBUTION == 'pareto' and THINK_TIME_PARETO_SHAPE <= 1:
+    raise Exception("think_time_pareto_shape must be greater than 1 for think times to have a finite mean")
+pacing_user_count = None
+# 'lease' gives each user a respondent of its own for as long as it runs, with the population split between workers
+# so no two users sign in to the same account. 'random' picks any respondent at each sign in, so users can share one
+RESPONDENT_ALLOCATION = os.getenv('respondent_allocation', 'lease')
+respondent_pool = None
+# With session_cache on, each worker signs in its respondents (the first session_prewarm_respondents of them, or all
+# when 0) before its users start. Those sign-ins are kept out of the test's stats, only failures being logged. Users
+# then reuse the sessions rather than signing in themselves until they are session_ttl_seconds old
+SESSION_CACHE = os.getenv('session_cache', 'false').lower() == 'true'
+SESSION_TTL_SECONDS = int(os.getenv('session_ttl_seconds', 1800))
+SESSION_PREWARM_RESPONDENTS = int(os.getenv('session_prewarm_respondents', 0))
+SESSION_PREWARM_CONCURRENCY = int(os.getenv('session_prewarm_concurrency', 10))
+# Client used to drive frontstage: 'http' (python-requests) or 'fasthttp' (geventhttpclient)
+FRONTSTAGE_CLIENT = os.getenv('frontstage_client', 'http')
+
+
+@events.init.add_listener
+def on_locust_init(environment, **kwargs):
+    if isinstance(environment.runner, WorkerRunner):
+        environment.runner.register_message('pacing_user_count', on_pacing_user_count)
+        environment.runner.register_message('respondent_partition', on_respondent_partition)
+
+    if isinstance(environment.runner, MasterRunner) and PACING_SCOPE == 'global':
+        environment.events.spawning_complete.add_listener(partial(send_pacing_user_count, environment.runner))
+
+
+# This will only be run on Master
+@events.test_start.add_listener
+def on_test_start(environment, **kwargs):
+    logger.info("on_test_start Locust runner: %s", environment.runner)
+    if isinstance(environment.runner, (MasterRunner, LocalRunner)) and RESPONDENT_ALLOCATION == 'lease':
+        assign_respondents(environment.runner)
+    if isinstance(environment.runner, (MasterRunner, LocalRunner)):
+        prepare_data(environment.runner)
+    if isinstance(environment.runner, MasterRunner) and PACING_SCOPE == 'global':
+        send_pacing_user_count(environment.runner)
+    if isinstance(environment.runner, (WorkerRunner, LocalRunner)) and SESSION_CACHE:
+        prewarm_sessions(environment)
+
+
+def sample_think_time(low, high):
+    mean = (low + high) / 2
+    if THINK_TIME_DISTRIBUTION == 'exponential':
+        return r.expovariate(1 / mean) if mean else 0
+    if THINK_TIME_DISTRIBUTION == 'pareto':
+        # Same mean as the other distributions, but with a long tail of slow respondents
+        return mean * (THINK_TIME_PARETO_SHAPE - 1) / THINK_TIME_PARETO_SHAPE * r.paretovariate(THINK_TIME_PARETO_SHAPE)
+    if THINK_TIME_DISTRIBUTION == 'constant':
+        return mean
+    return r.uniform(low, high)
+
+
+def pacing_interval(runner):
+    if PACING_SCOPE == 'global':
+        # Workers only know their own users until the master tells them the total
+        return (pacing_user_count or runner.target_user_count or 1) / TARGET_RATE
+    return 1 / TARGET_RATE
+
+
+def send_pacing_user_count(runner, **kwargs):
+    runner.send_message('pacing_user_count', runner.target_user_count)
+
+
+def on_pacing_user_count(environment, msg, **kwargs):
+    global pacing_user_count
+    pacing_user_count = msg.data
+
+
+def assign_respondents(runner):
+    global respondent_pool
+    if isinstance(runner, MasterRunner):
+        # Workers take every nth respondent, so each gets an even, non-overlapping share of the population
+        workers = sorted(worker.id for worker in runner.clients.values() if worker.state != STATE_MISSING)
+        for position, worker in enumerate(workers):
+            runner.send_message('respondent_partition', [position, len(workers)], client_id=worker)
+    else:
+        respondent_pool = RespondentPool(range(respondents))
+
+
+def on_respondent_partition(environment, msg, **kwargs):
+    global respondent_pool
+    position, workers = msg.data
+    respondent_pool = RespondentPool(range(position, respondents, workers))
+    logger.info("Assigned %s respondents to this worker", respondent_pool.size)
+
+
+def lease_respondent():
+    global respondent_pool
+    if RESPONDENT_ALLOCATION != 'lease':
+        return r.randint(0, respondents - 1)
+    if respondent_pool is None:
+        # Only a worker that joined after the test started misses out on its share
+        logger.warning("No respondents assigned to this worker, leasing from the whole population")
+        respondent_pool = RespondentPool(range(respondents))
+    return respondent_pool.lease()
+
+
+def release_respondent(respondent):
+    if RESPONDENT_ALLOCATION == 'lease':
+        respondent_pool.release(respondent)
+
+
+def prewarm_sessions(environment):
+    indices = respondent_pool.indices if respondent_pool else range(respondents)
+    indices = indices[:SESSION_PREWARM_RESPONDENTS] if SESSION_PREWARM_RESPONDENTS else indices
+    logger.info("Signing in %s respondents to warm the session cache", len(indices))
+    start = time.monotonic()
+    pool = Pool(SESSION_PREWARM_CONCURRENCY)
+    for respondent in indices:
+        pool.spawn(prewarm_session, environment, respondent)
+    pool.join()
+    logger.info("Warmed %s sessions in %.1fs", len(session_cache.sessions), time.monotonic() - start)
+
+
+def prewarm_session(environment, respondent):
+    # A request event of its own, so these sign-ins don't reach Locust's stats or the latency histograms
+    client = HttpSession(base_url=environment.host, request_event=EventHook(), user=None)
+    response = client.get("/sign-in")
+    csrf_token = capture_csrf_token(response.text)
+    response = client.post("/sign-in",
+                           data={**respondent_credentials(respondent), "csrf_token": csrf_token},
+                           allow_redirects=False)
+    if response.status_code != 302 or 'authorization' not in client.cookies:
+        logger.error(f"Unable to sign in respondent {respondent} ahead of the test: {response.status_code}")
+        return
+    session_cache.put(respondent, client.cookies, csrf_token)
+
+
+class Mixins:
+    csrf_token = None
+    auth_cookie = None
+    response = None
+    _page = None
+    _next_start = None
+    _intended_start = None
+    think_time = None
+
+    def get(
+        self,
+        url: str,
+        grouping: str=None,
+        expected_response_text: str=None,
+        expected_response_status: int=200,
+        expected_content_disposition: str=None,
+        expected_content_type: str=None,
+        expected_content_length: str=None,
+    ):
+        self.pace('request')
+        started = time.monotonic()
+        phases = start_phases(self.client)
+        with self.client.get(url=url, name=grouping, allow_redirects=False, catch_response=True) as response:
+            phases.finish("GET", grouping or url)
+            self.verify_response(expected_response_status, expected_response_text, response, url,
+                                 expected_content_disposition, expected_content_type, expected_content_length)
+            self.report_corrected_latency("GET", grouping or url, started)
+            self.think()
+            return response
+
+    def post(
+        self,
+        url: str,
+        data: dict = {},
+        grouping: str=None,
+        expected_response_text: str=None,
+        expected_response_status: int=200,
+        allow_redirects: bool=True,
+        files: dict=None,
+    ):
+        data = {**data, "csrf_token": self.csrf_token}
+
+        if files and isinstance(self.client, FastHttpSession):
+            # FastHttpSession has no files argument, so build the multipart body ourselves
+            fields = dict(data)
+            for name, (file_name, file, content_type) in files.items():
+                fields[name] = (file_name, file.read() if hasattr(file, 'read') else file, content_type)
+            body, content_type = encode_multipart_formdata(fields)
+            request_kwargs = {'data': body, 'headers': {'Content-Type': content_type}}
+        else:
+            request_kwargs = {'data': data, 'files': files}
+
+        self.pace('request')
+        started = time.monotonic()
+        phases = start_phases(self.client)
+        with self.client.post(
+            url=url,
+            name=grouping,
+            allow_redirects=allow_redirects,
+            catch_response=True,
+            **request_kwargs,
+        ) as response:
+            phases.finish("POST", grouping or url)
+            self.verify_response(expected_response_status, expected_response_text, response, url)
+            self.report_corrected_latency("POST", grouping or url, started)
+            self.think()
+            return response
+
+    # Sleeps until this user's next scheduled start. The time it should have started is kept so the next request's
+    # latency is measured from when a respondent would have sent it, not from when we got round to it
+    def pace(self, unit):
+        if PACING_MODE != 'constant' or PACING_UNIT != unit:
+            return
+        now = time.monotonic()
+        if self._next_start is None:
+            self._next_start = now
+        if self._next_start > now:
+            time.sleep(self._next_start - now)
+        self._intended_start = self._next_start
+        self._next_start += sample_think_time(0, 2 * pacing_interval(self.user.environment.runner))
+
+    def think(self):
+        if PACING_MODE != 'constant' or PACING_UNIT == 'iteration':
+            low, high = self.think_time or (USER_WAIT_TIME_MIN_SECONDS, USER_WAIT_TIME_MAX_SECONDS)
+            time.sleep(sample_think_time(low, high))
+
+    def report_corrected_latency(self, method, name, started):
+        if PACING_MODE != 'constant':
+            return
+        intended_start = min(self._intended_start or started, started)
+        self._intended_start = None
+        record_corrected_latency(method, name, (time.monotonic() - intended_start) * 1000)
+
+    # Each response is decoded and scanned at most once, later steps reuse the cached page
+    def page(self, response=None):
+        response = self.response if response is None else response
+        if self._page is None or self._page.response is not response:
+            self._page = HtmlPage(response)
+        return self._page
+
+    def cookie_jar(self):
+        return self.client.cookiejar if isinstance(self.client, FastHttpSession) else self.client.cookies
+
+    def resume_session(self):
+        session = session_cache.get(self.user.respondent) if SESSION_CACHE else None
+        if session is None:
+            return False
+        cookies, self.csrf_token = session
+        for cookie in cookies:
+            self.cookie_jar().set_cookie(cookie)
+        self.auth_cookie = next(cookie.value for cookie in cookies if cookie.name == 'authorization')
+        return True
+
+    def cache_session(self):
+        if SESSION_CACHE:
+            session_cache.put(self.user.respondent, self.cookie_jar(), self.csrf_token)
+
+    def get_cookie(self, response, name):
+        if isinstance(self.client, FastHttpSession):
+            return next((cookie.value for cookie in self.client.cookiejar if cookie.name == name), None)
+        return response.cookies[name]
+
+    def verify_response(self, expected_response_status, expected_response_text, response, url,
+                        expected_content_disposition=None, expected_content_type=None, expected_content_length=None):
+
+        if response.status_code != expected_response_status:
+            error = f"Expected a {expected_response_status} but got a {response.status_code} for url {url}"
+            response.failure(error)
+            self.interrupt()
+
+        if expected_response_text and expected_response_text not in self.page(response).text:
+            error = f"response text ({expected_response_text}) isn't in returned html"
+            response.failure(error)
+            self.interrupt()
+
+        if expected_content_disposition and expected_content_disposition != response.headers.get('Content-Disposition'):
+            error = f"Expected content disposition {expected_content_disposition} does not match returned header"
+            response.failure(error)
+            self.interrupt()
+
+        if expected_content_type and expected_content_type != response.headers.get('Content-type'):
+            error = f"Expected content type {expected_content_type} does not match returned header"
+            response.failure(error)
+            self.interrupt()
+
+        if expected_content_length and expected_content_length != response.headers.get('Content-Length'):
+            error = f"Expected content length {expected_content_length} does not match returned header"
+            response.failure(error)
+            self.interrupt()
+
+
+class FrontstageTasks(TaskSet, Mixins):
+
+    def on_start(self):
+        if not self.resume_session():
+            self.sign_in()
+
+    def on_stop(self):
+        # A task set that was interrupted signs in again rather than reusing a session that may be why it failed
+        session_cache.discard(self.user.respondent)
+
+    def sign_in(self):
+        self.response = self.get(url="/sign-in", expected_response_text="Sign in")
+        self.csrf_token = capture_csrf_token(self.page().text)
+        self.response = self.post(url="/sign-in",
+                                  data=respondent_credentials(self.user.respondent),
+                                  allow_redirects=False,
+                                  expected_response_status=302)
+        self.auth_cookie = self.get_cookie(self.response, 'authorization')
+        self.cache_session()
+
+
+# Holds one respondent for the whole life of the user, so an interrupted task set signs back in as the same respondent
+class LeasedRespondent:
+    respondent = None
+
+    def on_start(self):
+        self.respondent = lease_respondent()
+
+    def on_stop(self):
+        if self.respondent is not None:
+            release_respondent(self.respondent)
+            self.respondent = None
+
+
+# Free respondents are handed out oldest first, so load spreads evenly over the population. When they're all in use a
+# new user waits for one to be released rather than sharing an account
+class RespondentPool:
+
+    def __init__(self, indices):
+        self.indices = indices
+        self.size = len(indices)
+        self.free = Queue()
+        for index in indices:
+            self.free.put(index)
+
+    def lease(self):
+        if self.free.empty():
+            logger.warning("All %s respondents on this worker are in use, waiting for one to be released", self.size)
+        return self.free.get()
+
+    def release(self, index):
+        self.free.put(index)
+
+
+# Signed in sessions by respondent, kept until they're too old to trust
+class SessionCache:
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self.sessions = {}
+
+    def get(self, respondent):
+        session = self.sessions.get(respondent)
+        if session is None or session[0] < time.monotonic():
+            self.discard(respondent)
+            return None
+        return session[1], session[2]
+
+    def put(self, respondent, cookies, csrf_token):
+        self.sessions[respondent] = (time.monotonic() + self.ttl_seconds, tuple(cookies), csrf_token)
+
+    def discard(self, respondent):
+        self.sessions.pop(respondent, None)
+
+
+session_cache = SessionCache(SESSION_TTL_SECONDS)
+
+
+def respondent_credentials(respondent):
+    return {"username": respondent_email(respondent), "password": os.getenv("test_respondent_password")}
@@ -0,0 +1,109 @@
+import csv
+import os
+from collections import defaultdict
+
+from hdrh.histogram import HdrHistogram
+from locust import events
+
+from lib.config import logger
+from lib.results import results_writer
+
+# Every request's response time is also recorded in a high dynamic range histogram per grouping, which workers send to
+# the master encoded alongside their stats. The master merges them and write_latency_percentiles() writes the
+# percentiles from the merged histograms to LATENCY_PERCENTILES_FILE, rather than Locust's rounded approximations
+LATENCY_HISTOGRAMS = os.getenv('latency_histograms', 'true').lower() == 'true'
+LATENCY_PERCENTILES_FILE = 'rasrm_latency_percentiles.csv'
+LATENCY_PERCENTILES = (50, 90, 99, 99.9)
+# With constant pacing, latency measured from when each request should have been sent, which corrects for coordinated
+# omission, is kept in histograms of its own rather than reported to Locust as extra requests, and
+# write_corrected_latency() writes its percentiles to CORRECTED_LATENCY_FILE
+CORRECTED_LATENCY_FILE = 'rasrm_corrected_latency.csv'
+# Recorded in microseconds, from 1µs to an hour, to 3 significant figures
+HISTOGRAM_HIGHEST_MICROSECONDS = 60 * 60 * 1000 * 1000
+HISTOGRAM_SIGNIFICANT_FIGURES = 3
+
+
+def new_histogram():
+    return HdrHistogram(1, HISTOGRAM_HIGHEST_MICROSECONDS, HISTOGRAM_SIGNIFICANT_FIGURES)
+
+
+# Keyed by (method, name) like Locust's own stats
+latency_histograms = defaultdict(new_histogram)
+corrected_histograms = defaultdict(new_histogram)
+
+
+@events.request.add_listener
+def on_request(request_type, name, response_time, **kwargs):
+    if LATENCY_HISTOGRAMS and response_time is not None:
+        latency_histograms[(request_type, name)].record_value(
+            min(max(round(response_time * 1000), 1), HISTOGRAM_HIGHEST_MICROSECONDS))
+
+
+def record_corrected_latency(method, name, response_time):
+    corrected_histograms[(method, name)].record_value(
+        min(max(round(response_time * 1000), 1), HISTOGRAM_HIGHEST_MICROSECONDS))
+
+
+@events.report_to_master.add_listener
+def on_report_to_master(client_id, data, **kwargs):
+    if latency_histograms:
+        data['latency_histograms'] = drain_histograms(latency_histograms)
+    if corrected_histograms:
+        data['corrected_histograms'] = drain_histograms(corrected_histograms)
+
+
+@events.worker_report.add_listener
+def on_worker_report(client_id, data, **kwargs):
+    merge_histograms(latency_histograms, data.get('latency_histograms', []))
+    merge_histograms(corrected_histograms, data.get('corrected_histograms', []))
+
+
+# Encodes the histograms with values recorded since the last report as [*key, encoded] rows, so each report only
+# carries what's new, and starts them again from empty
+def drain_histograms(histograms):
+    rows = [[*key, histogram.encode()] for key, histogram in histograms.items() if histogram.get_total_count()]
+    histograms.clear()
+    return rows
+
+
+def merge_histograms(histograms, rows):
+    for *key, encoded in rows:
+        histograms[tuple(key)].decode_and_add(encoded)
+
+
+def milliseconds(microseconds):
+    return round(microseconds / 1000, 1)
+
+
+@results_writer
+def write_latency_percentiles(file_name=LATENCY_PERCENTILES_FILE):
+    return _write_percentiles(file_name, latency_histograms, "latency")
+
+
+@results_writer
+def write_corrected_latency(file_name=CORRECTED_LATENCY_FILE):
+    return _write_percentiles(file_name, corrected_histograms, "corrected latency")
+
+
+def _write_percentiles(file_name, histograms, description):
+    if not histograms:
+        return None
+    aggregated = new_histogram()
+    with open(file_name, 'w', newline='') as percentiles_file:
+        writer = csv.writer(percentiles_file)
+        writer.writerow(['Type', 'Name', 'Request Count', *(f"{percent}%" for percent in LATENCY_PERCENTILES),
+                         'Max'])
+        for (method, name), histogram in sorted(histograms.items()):
+            writer.writerow([method, name, *_percentile_row(histogram)])
+            aggregated.add(histogram)
+        writer.writerow(['', 'Aggregated', *_percentile_row(aggregated)])
+    logger.info("Aggregated %s over %s requests: %s", description, aggregated.get_total_count(),
+                ", ".join(f"p{percent} {milliseconds(aggregated.get_value_at_percentile(percent))}ms"
+                          for percent in LATENCY_PERCENTILES))
+    return file_name
+
+
+def _percentile_row(histogram):
+    return [histogram.get_total_count(),
+            *(milliseconds(histogram.get_value_at_percentile(percent)) for percent in LATENCY_PERCENTILES),
+            milliseconds(histogram.get_max_value())]
@@ -0,0 +1,158 @@
+import json
+import os
+from functools import partial
+from types import MappingProxyType
+from typing import Callable, Mapping, NamedTuple, Optional, Tuple
+
+from locust import task
+
+from lib.config import LOCUSTFILE_DIRECTORY, logger, r
+from lib.frontstage import FrontstageTasks
+
+# The requests users make, as a list of requests or of weighted journeys, in the locustfiles directory
+requests_file = LOCUSTFILE_DIRECTORY + os.getenv('requests_file')
+
+
+# Runs the request plan compiled from requests_file, one journey per iteration
+class JourneyTasks(FrontstageTasks):
+
+    @task
+    def perform_requests(self):
+        self.pace('iteration')
+        journey = r.choices(request_plan, weights=journey_weights)[0]
+        self.think_time = journey.think_time
+        for step in journey.steps:
+            if step.probability < 1 and r.random() >= step.probability:
+                continue
+
+            request_url = step.url
+            form_fields = {}
+
+            if step.harvest:
+                harvested_url, form_fields = step.harvest(self.page())
+                if step.url is None:
+                    if harvested_url is None:
+                        logger.error(f"Unable to harvest url for request {step.index} of journey {journey.name}")
+                        self.interrupt()
+                    request_url = harvested_url
+
+            if step.method == "GET":
+                self.response = self.get(request_url, step.grouping, step.expected_response_text,
+                                         step.expected_response_status)
+            else:
+                request_url = self.response.url if request_url == "self" else request_url
+                self.response = self.post(url=request_url,
+                                          data={**step.data, **form_fields} if form_fields else step.data,
+                                          grouping=step.grouping,
+                                          expected_response_text=step.expected_response_text,
+                                          expected_response_status=step.expected_response_status)
+
+
+# One entry of requests.json, validated and compiled once at import so users only execute it
+class RequestStep(NamedTuple):
+    index: int
+    method: str
+    url: Optional[str]
+    grouping: Optional[str]
+    expected_response_text: Optional[str]
+    expected_response_status: int
+    data: Mapping
+    harvest: Optional[Callable]
+    probability: float
+
+
+# A named sequence of requests, picked by weight at the start of each iteration
+class Journey(NamedTuple):
+    name: str
+    weight: float
+    think_time: Optional[Tuple[float, float]]
+    steps: Tuple[RequestStep, ...]
+
+
+# A file with a plain "requests" list is treated as a single journey
+def _compile_request_plan(requests_json):
+    journeys = requests_json.get("journeys") or [{"name": "requests", "requests": requests_json.get("requests")}]
+    return tuple(_compile_journey(journey) for journey in journeys)
+
+
+def _compile_journey(journey):
+    name = journey.get("name")
+    source = f"journey '{name}' in {requests_file}"
+    if not name or not journey.get("requests"):
+        raise Exception(f"Every journey in {requests_file} needs a name and some requests")
+
+    weight = float(journey.get("weight", 1))
+    if weight <= 0:
+        raise Exception(f"The weight of {source} must be greater than 0")
+
+    think_time = journey.get("think_time")
+    if think_time is not None:
+        think_time = (float(think_time["min"]), float(think_time["max"]))
+        if not 0 <= think_time[0] <= think_time[1]:
+            raise Exception(f"The think time of {source} needs 0 <= min <= max")
+
+    steps = tuple(_compile_request_step(index, request, source) for index, request in enumerate(journey["requests"]))
+    for previous, step in zip(steps, steps[1:]):
+        if step.harvest and previous.probability < 1:
+            raise Exception(f"Request {step.index} of {source} harvests from request {previous.index}, "
+                            f"which doesn't always run")
+    return Journey(name=name, weight=weight, think_time=think_time, steps=steps)
+
+
+def _compile_request_step(index, request, source):
+    method = request.get("method")
+    if method not in ("GET", "POST"):
+        raise Exception(f"Invalid request method {method} for request {index} of {source}, expected GET or POST")
+
+    harvest = None
+    harvest_details = request.get("harvest")
+    if harvest_details:
+        if harvest_details.get("type") == "url":
+            if not harvest_details.get("id") or not harvest_details.get("link_text"):
+                raise Exception(f"Request {index} of {source} harvests a url without an id and link_text")
+            harvest = partial(_harvest_link, harvest_details["id"], harvest_details["link_text"])
+        elif harvest_details.get("type") == "name":
+            if not harvest_details.get("names"):
+                raise Exception(f"Request {index} of {source} harvests inputs without any names")
+            harvest = partial(_harvest_inputs, tuple(harvest_details["names"]))
+        else:
+            raise Exception(f"Request {index} of {source} has unknown harvest type {harvest_details.get('type')}")
+
+    url = request.get("url")
+    if url is None and not (harvest_details and harvest_details["type"] == "url"):
+        raise Exception(f"Request {index} of {source} has no url and doesn't harvest one")
+    if url == "self" and method != "POST":
+        raise Exception(f"Request {index} of {source} can only use the 'self' url for a POST")
+
+    probability = float(request.get("probability", 1))
+    if not 0 < probability <= 1:
+        raise Exception(f"Request {index} of {source} has a probability outside (0, 1]")
+
+    return RequestStep(
+        index=index,
+        method=method,
+        url=url,
+        grouping=request.get("grouping"),
+        expected_response_text=request.get("expected_response_text"),
+        expected_response_status=int(request.get("response_status", 200)),
+        data=MappingProxyType(dict(request.get("data", {}))),
+        harvest=harvest,
+        probability=probability,
+    )
+
+
+def _harvest_link(link_id, link_text, page):
+    for link in page.find_all(id=link_id):
+        if link_text in link.text:
+            return link.attrs.get("href"), {}
+    return None, {}
+
+
+def _harvest_inputs(names, page):
+    return None, {name: page.input_value(name) for name in names}
+
+
+logger.info("Retrieving JSON requests from: %s", requests_file)
+with open(requests_file, encoding='utf-8') as requests_json:
+    request_plan = _compile_request_plan(json.load(requests_json))
+journey_weights = [journey.weight for journey in request_plan]
@@ -0,0 +1,74 @@
+import re
+from collections import defaultdict
+from html import unescape
+
+CSRF_REGEX = re.compile(r'<input id="csrf_token" name="csrf_token" type="hidden" value="(.+?)"\/?>')
+# Only the anchors, inputs and forms are pulled out of a page, rather than building a full DOM for every response
+ELEMENT_REGEX = re.compile(r'<(a|input|form)\b([^>]*)>', re.IGNORECASE)
+ATTRIBUTE_REGEX = re.compile(r'([\w:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))')
+ANCHOR_CLOSE_REGEX = re.compile(r'</a\s*>', re.IGNORECASE)
+TAG_REGEX = re.compile(r'<[^>]*>')
+
+
+class HtmlElement:
+
+    def __init__(self, tag, attrs, text=''):
+        self.tag = tag
+        self.attrs = attrs
+        self.text = text
+
+
+class HtmlPage:
+
+    def __init__(self, response):
+        self.response = response
+        self.text = response.text
+        self._elements = None
+        self._ids = None
+        self._inputs = None
+
+    def elements(self):
+        if self._elements is None:
+            self._elements = []
+            self._ids = defaultdict(list)
+            self._inputs = {}
+            for match in ELEMENT_REGEX.finditer(self.text):
+                tag = match.group(1).lower()
+                attrs = {}
+                for attribute in ATTRIBUTE_REGEX.finditer(match.group(2)):
+                    value = next(value for value in attribute.group(2, 3, 4) if value is not None)
+                    attrs[attribute.group(1).lower()] = unescape(value)
+                text = ''
+                if tag == 'a':
+                    close = ANCHOR_CLOSE_REGEX.search(self.text, match.end())
+                    if close:
+                        text = unescape(TAG_REGEX.sub('', self.text[match.end():close.start()])).strip()
+                element = HtmlElement(tag, attrs, text)
+                self._elements.append(element)
+                if 'id' in attrs:
+                    self._ids[attrs['id']].append(element)
+                if tag == 'input' and 'name' in attrs:
+                    self._inputs.setdefault(attrs['name'], element)
+        return self._elements
+
+    def find_all(self, id):
+        self.elements()
+        return self._ids.get(id, [])
+
+    def find(self, id):
+        return next(iter(self.find_all(id)), None)
+
+    def input_value(self, name):
+        self.elements()
+        element = self._inputs.get(name)
+        return element.attrs.get('value') if element else None
+
+    def link_href(self, text):
+        return next((element.attrs['href'] for element in self.elements()
+                     if element.tag == 'a' and 'href' in element.attrs and element.text == text), None)
+
+
+def capture_csrf_token(html):
+    match = CSRF_REGEX.search(html)
+    if match:
+        return match.group(1)
@@ -0,0 +1,205 @@
+import csv
+import os
+import socket
+import time
+from collections import defaultdict
+
+from gevent.local import local
+from locust import events
+from locust.clients import HttpSession
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.connection import allowed_gai_family
+
+from lib.config import logger
+from lib.histograms import (HISTOGRAM_HIGHEST_MICROSECONDS, drain_histograms, merge_histograms, milliseconds,
+                             new_histogram)
+from lib.results import results_writer
+
+# Splits the time of each frontstage request into DNS lookup, connecting (including any TLS handshake), time to first
+# byte after that and transferring the body. Both clients are instrumented where they resolve and connect, which only
+# happens for requests that open a new connection, and when response headers arrive. The phases are recorded per
+# grouping in histograms merged on the master like the latency ones, and written to PHASE_STATS_FILE
+PHASE_TIMINGS = os.getenv('phase_timings', 'true').lower() == 'true'
+PHASE_STATS_FILE = 'rasrm_phase_stats.csv'
+PHASES = ('DNS', 'Connect', 'TTFB', 'Transfer')
+PHASE_PERCENTILES = (50, 95)
+
+# Keyed by (method, name, phase), with the total microseconds recorded in each kept alongside, as working the mean out
+# from an HDR histogram means walking every one of its buckets
+phase_histograms = defaultdict(new_histogram)
+phase_totals = defaultdict(int)
+# The request each user's greenlet is making, for the client hooks to add their timings to
+current = local()
+
+
+@events.report_to_master.add_listener
+def on_report_to_master(client_id, data, **kwargs):
+    if phase_histograms:
+        data['phase_histograms'] = drain_histograms(phase_histograms)
+        data['phase_totals'] = [[*key, total] for key, total in phase_totals.items()]
+        phase_totals.clear()
+
+
+@events.worker_report.add_listener
+def on_worker_report(client_id, data, **kwargs):
+    merge_histograms(phase_histograms, data.get('phase_histograms', []))
+    for *key, total in data.get('phase_totals', []):
+        phase_totals[tuple(key)] += total
+
+
+# Call just before a request is sent from the user's greenlet and finish() it once the body has been read
+def start_phases(client):
+    if PHASE_TIMINGS and not getattr(client, 'phase_timed', False):
+        instrument_client(client)
+    current.phases = RequestPhases()
+    return current.phases
+
+
+def instrument_client(client):
+    if isinstance(client, HttpSession):
+        client.hooks['response'].append(_on_response_headers)
+        for adapter in client.adapters.values():
+            adapter.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool,
+                                                          'https': TimedHTTPSConnectionPool}
+    else:
+        user_agent = client.client
+        user_agent._urlopen = _headers_timed(user_agent._urlopen)
+        user_agent.clientpool.get_client = _connections_timed(user_agent.clientpool.get_client)
+    client.phase_timed = True
+
+
+@results_writer
+def write_phase_stats(file_name=PHASE_STATS_FILE):
+    groupings = sorted({(method, name) for method, name, phase in phase_histograms})
+    if not groupings:
+        return None
+    with open(file_name, 'w', newline='') as stats_file:
+        writer = csv.writer(stats_file)
+        header = ['Type', 'Name', 'Request Count']
+        for phase in PHASES:
+            header += [f"Average {phase} (ms)", *(f"{phase} {percent}% (ms)" for percent in PHASE_PERCENTILES)]
+        writer.writerow(header)
+        for method, name in groupings:
+            keys = [(method, name, phase) for phase in PHASES]
+            writer.writerow([method, name, phase_histograms[keys[0]].get_total_count(),
+                             *(value for key in keys for value in _phase_row(key))])
+            logger.info("%s %s: %s", method, name, ", ".join(
+                f"{phase} {_phase_mean(key)}ms" for phase, key in zip(PHASES, keys)))
+    return file_name
+
+
+class RequestPhases:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.dns = 0
+        self.connect = 0
+        # When the headers of the last response arrived, following any redirects
+        self.headers = None
+
+    def finish(self, method, name):
+        finished = time.perf_counter()
+        if getattr(current, 'phases', None) is self:
+            current.phases = None
+        if not PHASE_TIMINGS:
+            return
+        headers = self.headers or finished
+        timings = (self.dns, self.connect, max(headers - self.started - self.dns - self.connect, 0), finished - headers)
+        for phase, seconds in zip(PHASES, timings):
+            microseconds = min(round(seconds * 1000 * 1000), HISTOGRAM_HIGHEST_MICROSECONDS)
+            phase_histograms[(method, name, phase)].record_value(microseconds)
+            phase_totals[(method, name, phase)] += microseconds
+
+
+# Resolves the host itself so the lookup can be timed apart from the connection that follows
+class PhaseTimedConnection:
+
+    def connect(self):
+        phases = getattr(current, 'phases', None)
+        if phases is None:
+            return super().connect()
+        started = time.perf_counter()
+        dns = phases.dns
+        super().connect()
+        phases.connect += time.perf_counter() - started - (phases.dns - dns)
+
+    def _new_conn(self):
+        phases = getattr(current, 'phases', None)
+        if phases is None:
+            return super()._new_conn()
+        started = time.perf_counter()
+        dns_host = self._dns_host
+        self._dns_host = socket.getaddrinfo(dns_host, self.port, allowed_gai_family(), socket.SOCK_STREAM)[0][4][0]
+        phases.dns += time.perf_counter() - started
+        try:
+            return super()._new_conn()
+        finally:
+            self._dns_host = dns_host
+
+
+class TimedHTTPConnection(PhaseTimedConnection, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(PhaseTimedConnection, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+def _on_response_headers(response, *args, **kwargs):
+    phases = getattr(current, 'phases', None)
+    if phases is not None:
+        phases.headers = time.perf_counter()
+    return response
+
+
+def _headers_timed(urlopen):
+    def timed(*args, **kwargs):
+        response = urlopen(*args, **kwargs)
+        _on_response_headers(response)
+        return response
+    return timed
+
+
+# geventhttpclient makes a connection pool per host, with _resolve and _connect_socket hooks for each step
+def _connections_timed(get_client):
+    def timed(*args, **kwargs):
+        http_client = get_client(*args, **kwargs)
+        pool = http_client._connection_pool
+        if not getattr(pool, 'phase_timed', False):
+            pool._resolve = _phase_timed(pool._resolve, 'dns')
+            pool._connect_socket = _phase_timed(pool._connect_socket, 'connect')
+            pool.phase_timed = True
+        return http_client
+    return timed
+
+
+def _phase_timed(func, phase):
+    def timed(*args, **kwargs):
+        phases = getattr(current, 'phases', None)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if phases is not None:
+                setattr(phases, phase, getattr(phases, phase) + time.perf_counter() - started)
+    return timed
+
+
+def _phase_row(key):
+    histogram = phase_histograms[key]
+    return [_phase_mean(key),
+            *(milliseconds(histogram.get_value_at_percentile(percent)) for percent in PHASE_PERCENTILES)]
+
+
+def _phase_mean(key):
+    count = phase_histograms[key].get_total_count()
+    return milliseconds(phase_totals[key] / count) if count else 0.0
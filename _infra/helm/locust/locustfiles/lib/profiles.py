@@ -0,0 +1,84 @@
+import importlib
+import os
+from typing import NamedTuple, Optional
+
+profiles = {}
+survey_profile = None
+
+
+# Everything that differs between the surveys the tests run against: the survey and collection exercise the data load
+# creates, its collection instrument and the task set users run. A new survey is a new profile, not a new locustfile
+class SurveyProfile(NamedTuple):
+    short_name: str
+    long_name: str
+    survey_ref: str
+    form_type: str
+    period: str
+    collection_exercise_config: str
+    collection_exercise_event_config: str
+    # 'eq' links the eQ identified by eq_id, 'seft' uploads seft_file from the locustfiles directory
+    collection_instrument: str
+    # Dotted path of the TaskSet users run, only imported for the profile that is selected
+    tasks: str
+    eq_id: Optional[str] = None
+    seft_file: Optional[str] = None
+
+
+def register_profile(profile):
+    if profile.collection_instrument == 'eq' and not profile.eq_id:
+        raise Exception(f"Survey profile {profile.short_name} has an eQ collection instrument without an eq_id")
+    if profile.collection_instrument == 'seft' and not profile.seft_file:
+        raise Exception(f"Survey profile {profile.short_name} has a SEFT collection instrument without a seft_file")
+    if profile.collection_instrument not in ('eq', 'seft'):
+        raise Exception(f"Survey profile {profile.short_name} has unknown collection instrument "
+                        f"{profile.collection_instrument}")
+    profiles[profile.short_name] = profile
+    return profile
+
+
+# Each locustfile names the profile it runs by default, which survey_profile overrides
+def select_profile(default):
+    global survey_profile
+    name = os.getenv('survey_profile') or default
+    if name not in profiles:
+        raise Exception(f"Unknown survey profile {name}, expected one of {', '.join(profiles)}")
+    survey_profile = profiles[name]
+    return survey_profile
+
+
+def get_profile():
+    if survey_profile is None:
+        raise Exception("No survey profile selected, the locustfile must call select_profile")
+    return survey_profile
+
+
+def load_tasks(profile):
+    module_name, _, class_name = profile.tasks.rpartition('.')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+register_profile(SurveyProfile(
+    short_name='QBS',
+    long_name='Quarterly Business Survey',
+    survey_ref='139',
+    form_type='0001',
+    period='1806',
+    collection_exercise_config='collection-exercise-config.json',
+    collection_exercise_event_config='collection-exercise-event-config.json',
+    collection_instrument='eq',
+    eq_id='2',
+    tasks='lib.journeys.JourneyTasks',
+))
+
+register_profile(SurveyProfile(
+    short_name='ASHE',
+    long_name='Annual Survey of Hours and Earnings',
+    survey_ref='141',
+    form_type='0001',
+    period='1806',
+    collection_exercise_config='collection-exercise-seft-config.json',
+    collection_exercise_event_config='collection-exercise-seft-event-config.json',
+    collection_instrument='seft',
+    seft_file='065_201803_0001.xlsx',
+    tasks='lib.seft.SeftTasks',
+))
@@ -0,0 +1,121 @@
+import csv
+import time
+from functools import partial
+
+import gevent
+from locust.runners import LocalRunner, MasterRunner
+from locust.stats import PERCENTILES_TO_REPORT, StatsCSV, get_readable_percentiles
+
+from lib.config import logger
+from lib.shapes import LOAD_SHAPE_FILE, STAGE_STATS_FILE
+from lib.storage import upload_results
+
+# Workers send their last stats and histograms as the runner quits, which Locust only does after its quitting event and
+# after its own --csv writer last flushed, so the master writes the results itself from its stats once Locust has quit.
+# The stats history is appended to as the test runs, a row a second, and so can't share a --csv prefix with Locust
+RESULTS_CSV_PREFIX = 'rasrm'
+STATS_FILE = f'{RESULTS_CSV_PREFIX}_stats.csv'
+FAILURES_FILE = f'{RESULTS_CSV_PREFIX}_failures.csv'
+STATS_HISTORY_FILE = f'{RESULTS_CSV_PREFIX}_stats_history.csv'
+STATS_HISTORY_INTERVAL_SECONDS = 1
+# Functions that write a results file of their own on the master once Locust has quit, returning its name or None when
+# there was nothing to write. Modules add theirs with @results_writer, so only the ones a locustfile imports are run
+writers = []
+
+
+def results_writer(write):
+    writers.append(write)
+    return write
+
+
+# Called from each locustfile's init listener, so every locustfile writes its results the same way
+def record_results(environment, upload):
+    if not isinstance(environment.runner, (MasterRunner, LocalRunner)):
+        return
+    if environment.parsed_options and environment.parsed_options.csv_prefix == RESULTS_CSV_PREFIX:
+        raise Exception(f"Locust's --csv {RESULTS_CSV_PREFIX} files would clash with the results written when it "
+                        f"quits, use another prefix")
+    history = StatsHistory(STATS_HISTORY_FILE)
+    environment.events.test_start.add_listener(partial(start_stats_history, history))
+    environment.events.quit.add_listener(partial(write_results, environment, history, upload))
+
+
+def start_stats_history(history, environment, **kwargs):
+    history.start(environment)
+
+
+def write_results(environment, history, upload, **kwargs):
+    results = [write_stats(environment), write_failures(environment), history.finish()]
+    if LOAD_SHAPE_FILE and environment.shape_class:
+        results.append(STAGE_STATS_FILE)
+    results += [write() for write in writers]
+    results = [file_name for file_name in results if file_name]
+    logger.info("Wrote results %s", ", ".join(results))
+    if upload:
+        upload_results(results)
+
+
+def write_stats(environment, file_name=STATS_FILE):
+    with open(file_name, 'w', newline='') as stats_file:
+        StatsCSV(environment, PERCENTILES_TO_REPORT).requests_csv(csv.writer(stats_file))
+    return file_name
+
+
+def write_failures(environment, file_name=FAILURES_FILE):
+    with open(file_name, 'w', newline='') as failures_file:
+        StatsCSV(environment, PERCENTILES_TO_REPORT).failures_csv(csv.writer(failures_file))
+    return file_name
+
+
+# The aggregated row of Locust's stats history CSV, started again with each test and flushed as each row is written
+class StatsHistory:
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.environment = None
+        self.history_file = None
+        self.writer = None
+        self.greenlet = None
+
+    def start(self, environment):
+        self.stop()
+        self.environment = environment
+        self.history_file = open(self.file_name, 'w', newline='')
+        self.writer = csv.writer(self.history_file)
+        self.writer.writerow(['Timestamp', 'User Count', 'Type', 'Name', 'Requests/s', 'Failures/s',
+                              *get_readable_percentiles(PERCENTILES_TO_REPORT), 'Total Request Count',
+                              'Total Failure Count', 'Total Median Response Time', 'Total Average Response Time',
+                              'Total Min Response Time', 'Total Max Response Time', 'Total Average Content Size'])
+        self.greenlet = gevent.spawn(self.record)
+
+    def record(self):
+        while True:
+            self.write_row()
+            gevent.sleep(STATS_HISTORY_INTERVAL_SECONDS)
+
+    def write_row(self):
+        total = self.environment.stats.total
+        self.writer.writerow([
+            int(time.time()), self.environment.runner.user_count, '', total.name, f"{total.current_rps:2f}",
+            f"{total.current_fail_per_sec:2f}",
+            *(int(total.get_response_time_percentile(percent)) if total.num_requests else 'N/A'
+              for percent in PERCENTILES_TO_REPORT),
+            total.num_requests, total.num_failures, total.median_response_time, total.avg_response_time,
+            total.min_response_time or 0, total.max_response_time, total.avg_content_length])
+        self.history_file.flush()
+
+    # Ends the history with a row of the final stats, or returns None if no test was started
+    def finish(self):
+        if self.history_file is None:
+            return None
+        self.write_row()
+        self.stop()
+        return self.file_name
+
+    def stop(self):
+        if self.greenlet is not None:
+            self.greenlet.kill()
+            self.greenlet = None
+        if self.history_file is not None:
+            self.history_file.close()
+            self.history_file = None
@@ -0,0 +1,1040 @@
+import csv
+import io
+import json
+import os
+import random
+import requests
+import socket
+import gevent
+import tempfile
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import timezone, datetime
+from functools import partial
+from gevent.event import AsyncResult
+from gevent.lock import BoundedSemaphore
+from gevent.pool import Pool
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from urllib3.util.retry import Retry
+
+from locust import events
+from locust.runners import MasterRunner, LocalRunner, WorkerRunner
+
+from lib.config import LOCUSTFILE_DIRECTORY, logger, respondent_email, respondents
+from lib.profiles import get_profile
+from lib.storage import results_backend
+
+# Ignore these during collection exercise event processing as they are the key
+# for the collection exercise and don't represent event data
+ignore_columns = ['surveyRef', 'exerciseRef']
+# Number of respondents taken through the registration pipeline at the same time
+REGISTRATION_CONCURRENCY = int(os.getenv('registration_concurrency', 20))
+# Connection pooling, retry and concurrency limits for the admin API calls made while loading data
+ADMIN_POOL_SIZE = int(os.getenv('admin_pool_size', 20))
+ADMIN_MAX_RETRIES = int(os.getenv('admin_max_retries', 3))
+ADMIN_RETRY_BACKOFF_SECONDS = float(os.getenv('admin_retry_backoff_seconds', 0.5))
+ADMIN_MAX_CONCURRENCY = int(os.getenv('admin_max_concurrency', 50))
+admin_client = None
+# Sample files are generated and uploaded in chunks of this size. Set sample_file_directory to keep the generated
+# sample on disk and reuse it on later runs with the same number of respondents
+SAMPLE_CHUNK_BYTES = int(os.getenv('sample_chunk_bytes', 1024 * 1024))
+SAMPLE_FILE_DIRECTORY = os.getenv('sample_file_directory')
+# Readiness polling backs off exponentially between these delays and gives up after the relevant timeout
+POLL_INITIAL_DELAY_SECONDS = float(os.getenv('poll_initial_delay_seconds', 0.25))
+POLL_MAX_DELAY_SECONDS = float(os.getenv('poll_max_delay_seconds', 5))
+SAMPLE_READY_TIMEOUT_SECONDS = int(os.getenv('sample_ready_timeout_seconds', 120))
+COLLECTION_EXERCISE_READY_TIMEOUT_SECONDS = int(os.getenv('collection_exercise_ready_timeout_seconds', 120))
+COLLECTION_EXERCISE_LIVE_TIMEOUT_SECONDS = int(os.getenv('collection_exercise_live_timeout_seconds', 600))
+CASE_IAC_TIMEOUT_SECONDS = int(os.getenv('case_iac_timeout_seconds', 300))
+# Cases for respondents waiting to register are checked for IACs in batches of this size every interval
+IAC_WATCH_BATCH_SIZE = int(os.getenv('iac_watch_batch_size', 50))
+IAC_WATCH_INTERVAL_SECONDS = float(os.getenv('iac_watch_interval_seconds', 1))
+# Rows of the collection exercise and event files are posted this many at a time
+ROW_CONCURRENCY = int(os.getenv('row_concurrency', 10))
+# Progress of the data load is checkpointed so an interrupted load can be resumed, and a completed load is verified by
+# checking this many randomly chosen respondents. The checkpoint is written to SEED_CHECKPOINT_FILE as the load goes and
+# copied to the results backend (next to the seed marker) after each stage and every SEED_CHECKPOINT_SYNC_SECONDS while
+# registering, as the local file goes with the pod, e.g. when the seed job is retried
+SEED_CHECKPOINT_FILE = os.getenv('seed_checkpoint_file', 'rasrm_seed_checkpoint.jsonl')
+SEED_CHECKPOINT_SYNC_SECONDS = int(os.getenv('seed_checkpoint_sync_seconds', 30))
+SEED_VERIFY_SAMPLE_SIZE = int(os.getenv('seed_verify_sample_size', 5))
+# When enabled, respondent registration is split across the connected workers instead of all running on the master
+DISTRIBUTED_REGISTRATION = os.getenv('distributed_registration', 'false').lower() == 'true'
+REGISTRATION_SHARD_TIMEOUT_SECONDS = int(os.getenv('registration_shard_timeout_seconds', 3600))
+registration_shards = {}
+# Where the data load runs: 'inline' loads it when the test starts, 'background' starts loading as soon as the master
+# is up and 'external' expects the seed job (python locustfile.py) to load it. Either way users aren't spawned until
+# the data is ready
+SEED_MODE = os.getenv('seed_mode', 'inline')
+SEED_MODES = ('inline', 'background', 'external')
+if SEED_MODE not in SEED_MODES:
+    raise Exception(f"Unknown seed_mode {SEED_MODE}, expected one of {', '.join(SEED_MODES)}")
+SEED_WAIT_TIMEOUT_SECONDS = int(os.getenv('seed_wait_timeout_seconds', 7200))
+SEED_PROGRESS_INTERVAL_SECONDS = int(os.getenv('seed_progress_interval_seconds', 30))
+# The seed job marks a finished load by writing this to the results backend (the bucket, or results_directory for the
+# 'local' backend), and removes it before it starts loading. The master waits for it rather than sampling respondents,
+# which could already be registered while the job is still working through the rest
+SEED_MARKER_DIRECTORY = 'seed'
+seed_greenlet = None
+
+
+# Load data for tests
+def load_data(checkpoint, runner, survey):
+    client = get_admin_client()
+
+    logger.info("Container host: %s, survey profile: %s", socket.gethostname(), survey.short_name)
+
+    survey_id = run_stage(checkpoint, 'survey', load_survey, client, survey)
+    run_stage(checkpoint, 'collection_exercises', load_collection_exercises, client, survey)
+    run_stage(checkpoint, 'collection_exercise_events', load_collection_exercise_events, client, survey)
+    run_stage(checkpoint, 'collection_instrument', load_and_link_collection_instrument, client, survey_id, survey)
+    run_stage(checkpoint, 'sample', load_and_link_sample, client, survey)
+    run_stage(checkpoint, 'execution', execute_collection_exercise, client, survey_id, survey)
+    run_stage(checkpoint, 'registration', register_users, client, checkpoint, runner)
+    logger.info("Reference data cache: %s hits, %s misses", reference_data.hits, reference_data.misses)
+
+
+def run_stage(checkpoint, stage, load, *args):
+    if checkpoint.is_complete(stage):
+        logger.info("Skipping %s, already completed according to checkpoint", stage)
+        return checkpoint.stage_result(stage)
+
+    result = load(*args)
+    checkpoint.complete_stage(stage, result)
+    return result
+
+
+# Survey loading
+def load_survey(client, survey):
+    return reference_data.get('survey', survey.short_name, partial(find_or_create_survey, client, survey))
+
+
+def find_or_create_survey(client, survey):
+    logger.info('Trying to find survey %s', survey.short_name)
+    get_url = f"{os.getenv('survey')}/surveys/shortname/{survey.short_name}"
+    get_response = client.get(get_url)
+
+    try:
+        get_response.raise_for_status()
+        get_data = get_response.json()
+        logger.info("Survey successfully found at id %s", get_data['id'])
+        return get_data['id']
+    except requests.exceptions.HTTPError:
+        logger.error("Couldn't find survey %s, status code %s, message %s", survey.short_name, get_response.status_code,
+                     get_response.text)
+
+    create_url = f"{os.getenv('survey')}/surveys"
+    survey_details = {"surveyRef": survey.survey_ref, "longName": survey.long_name, "shortName": survey.short_name,
+                      "legalBasisRef": 'STA1947', "surveyType": 'Business',
+                      "classifiers": [{"name": "COLLECTION_INSTRUMENT", "classifierTypes": ["FORM_TYPE"]},
+                                      {"name": "COMMUNICATION_TEMPLATE", "classifierTypes": ["LEGAL_BASIS", "REGION"]}]}
+
+    create_response = client.post(create_url, json=survey_details)
+    try:
+        create_response.raise_for_status()
+        create_data = json.loads(create_response.text)
+        logger.info("Successfully created survey at id %s", create_data['id'])
+        return create_data['id']
+    except requests.exceptions.HTTPError:
+        if create_response.status_code == 409:
+            # it exists try to retrieve it again
+            return find_or_create_survey(client, survey)
+        logger.exception("failed to obtain survey id")
+
+
+# Helper methods for Collection exercise/event mapping
+def map_columns(column_mappings, row):
+    new_row = dict()
+    for key, value in row.items():
+        try:
+            if key and value:
+                new_row[column_mappings[key] if column_mappings[key] else key] = value
+        except KeyError:
+            new_row[key] = value
+    return new_row
+
+
+def process_files(file_list, row_handler, column_mappings):
+    pool = Pool(ROW_CONCURRENCY)
+    rows = []
+    for filename in file_list:
+        with open(filename) as fp:
+            reader = csv.DictReader(fp)
+            for row in reader:
+                new_row = map_columns(column_mappings, row)
+
+                if new_row:
+                    rows.append(pool.spawn(row_handler, data=new_row))
+    pool.join()
+
+    failures = [row for row in rows if not row.successful()]
+    logger.info("Processed %s rows from %s, %s failed", len(rows), file_list, len(failures))
+    if failures:
+        raise failures[0].exception
+
+
+def reformat_date(date):
+    if len(date) == 5:
+        # Looks like the dates are zero padded unless the day number is < 10 in which case the 0 is missing
+        # so if we have a 5 digit date we can assume it's a date in the first 9 days of a month and prefixing
+        # a zero will give us the correct value
+        date = '0' + date
+
+    try:
+        raw = datetime.strptime(date, '%d%m%y')
+        raw = raw.replace(tzinfo=timezone.utc)
+    except ValueError:
+        print("Failed to parse {}".format(date))
+        raise
+
+    time_str = raw.isoformat(timespec='milliseconds')
+    return time_str
+
+
+# Collection exercise loading
+def load_collection_exercises(client, survey):
+    config = json.load(open(LOCUSTFILE_DIRECTORY + survey.collection_exercise_config))
+    input_files = config['inputFiles']
+    column_mappings = config['columnMappings']
+    url = f"{os.getenv('collection_exercise')}/collectionexercises"
+
+    row_handler = partial(post_collection_exercise, url=url, client=client)
+
+    logger.info('Posting collection exercises')
+    process_files(input_files, row_handler, column_mappings)
+
+
+def post_collection_exercise(data, url, client):
+    response = client.post(url, json=data, verify=False)
+
+    status_code = response.status_code
+    detail_text = response.text if status_code != 201 else ''
+
+    logger.info("%s <= %s (%s)", status_code, data, detail_text)
+
+
+# Collection exercise event loading
+def load_collection_exercise_events(client, survey):
+    config = json.load(open(LOCUSTFILE_DIRECTORY + survey.collection_exercise_event_config))
+    input_files = config['inputFiles']
+    column_mappings = config['columnMappings']
+    url = f"{os.getenv('collection_exercise')}/collectionexercises"
+
+    row_handler = partial(process_event_row, client=client, url=url)
+
+    process_files(input_files, row_handler, column_mappings)
+
+
+def process_event_row(data, client, url):
+    collection_exercise = get_collection_exercise(survey_ref=data['surveyRef'], exercise_ref=data['exerciseRef'],
+                                                  url=url, client=client)
+    if collection_exercise:
+        collection_exercise_id = collection_exercise['id']
+        posts = {event_tag: gevent.spawn(post_event, collection_exercise_id, event_tag, date, client, url)
+                 for event_tag, date in data.items() if event_tag not in ignore_columns}
+        gevent.joinall(list(posts.values()))
+
+        failures = []
+        for event_tag, post in posts.items():
+            if not post.successful():
+                failures.append(f"{event_tag} ({post.exception})")
+            elif post.value.status_code != 201:
+                failures.append(f"{event_tag} ({post.value.status_code} {post.value.text})")
+
+        if failures:
+            logger.error("Posted %s of %s events for survey %s, exercise %s, failed: %s", len(posts) - len(failures),
+                         len(posts), data['surveyRef'], data['exerciseRef'], ', '.join(failures))
+        else:
+            logger.info("Posted %s events for survey %s, exercise %s", len(posts), data['surveyRef'],
+                        data['exerciseRef'])
+
+
+def get_collection_exercise(survey_ref, exercise_ref, url, client, refresh=False):
+    if refresh:
+        reference_data.invalidate('collection_exercise', (survey_ref, exercise_ref))
+    return reference_data.get('collection_exercise', (survey_ref, exercise_ref),
+                              partial(fetch_collection_exercise, survey_ref, exercise_ref, url, client))
+
+
+def fetch_collection_exercise(survey_ref, exercise_ref, url, client):
+    response = client.get(f'{url}/{exercise_ref}/survey/{survey_ref}', verify=False)
+
+    try:
+        response.raise_for_status()
+        data = response.json()
+        if "error" in data:
+            logger.error("Error getting collection exercise ID for survey %s, exercise %s, error %s", survey_ref,
+                         exercise_ref, data['error'])
+        else:
+            return data
+    except requests.exceptions.HTTPError:
+        logger.exception("Error getting collection exercise data")
+
+
+def post_event(collection_exercise_id, event_tag, date, client, url):
+    data = {"tag": event_tag, "timestamp": reformat_date(date)}
+
+    response = client.post(f'{url}/{collection_exercise_id}/events', json=data, verify=False)
+    logger.debug("%s <= %s", response.status_code, data)
+    return response
+
+
+# Collection instrument loading
+def load_and_link_collection_instrument(client, survey_id, survey):
+    collection_exercise_url = f"{os.getenv('collection_exercise')}/collectionexercises"
+    collection_exercise = get_collection_exercise(survey.survey_ref, survey.period, collection_exercise_url, client)
+
+    if survey.collection_instrument == 'seft':
+        upload_seft_collection_instrument(client, survey_id, survey, collection_exercise)
+    else:
+        upload_eq_collection_instrument(client, survey_id, survey)
+
+    get_url = f"{os.getenv('collection_instrument')}/collection-instrument-api/1.0.2/collectioninstrument"
+    get_classifiers = {"form_type": survey.form_type, "SURVEY_ID": survey_id}
+
+    get_response = client.get(url=get_url, params={'searchString': json.dumps(get_classifiers)})
+    get_response.raise_for_status()
+
+    if collection_exercise:
+        collection_exercise_id = collection_exercise['id']
+
+        for ci in json.loads(get_response.text):
+            logger.info('Linking collection instrument %s to exercise %s', ci['id'], survey.period)
+            link_url = f"{os.getenv('collection_instrument')}/collection-instrument-api/1.0.2/link-exercise/{ci['id']}/{collection_exercise_id}"
+            link_response = client.post(url=link_url)
+            link_response.raise_for_status()
+
+        logger.info('Successfully linked collection instruments to exercise %s', survey.period)
+    else:
+        logger.error("Error retrieving collection exercise")
+
+
+def upload_eq_collection_instrument(client, survey_id, survey):
+    logger.info('Uploading eQ collection instrument', extra={'survey_id': survey_id, 'form_type': survey.form_type})
+    post_url = f"{os.getenv('collection_instrument')}/collection-instrument-api/1.0.2/upload"
+
+    post_classifiers = {"form_type": survey.form_type, "eq_id": survey.eq_id}
+
+    params = {"classifiers": json.dumps(post_classifiers), "survey_id": survey_id}
+
+    client.post(url=post_url, params=params)
+
+
+def upload_seft_collection_instrument(client, survey_id, survey, collection_exercise):
+    collection_exercise_id = collection_exercise['id'] if collection_exercise else ""
+
+    logger.info('Uploading SEFT collection instrument', extra={'survey_id': survey_id, 'form_type': survey.form_type})
+    post_url = f"{os.getenv('collection_instrument')}/collection-instrument-api/1.0.2/upload/{collection_exercise_id}"
+
+    post_classifiers = {"form_type": survey.form_type}
+
+    params = {"classifiers": json.dumps(post_classifiers), "survey_id": survey_id}
+
+    with open(LOCUSTFILE_DIRECTORY + survey.seft_file, "rb") as file_stream:
+        files = {"file": (survey.seft_file, file_stream, "application/json")}
+        client.post(url=post_url, files=files, params=params)
+
+
+# Sample generation/loading/linking
+def load_and_link_sample(client, survey):
+    logger.info('Generating and loading sample for survey %s, period %s', survey.survey_ref, survey.period)
+    sample_url = f"{os.getenv('sample_file_uploader')}/samples/fileupload"
+    boundary = uuid.uuid4().hex
+    headers = {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    with multipart_file_body(boundary, 'test_sample_file.xlxs', 'text/csv',
+                             sample_file_chunks(respondents, survey)) as body:
+        sample_response = client.post(url=sample_url, data=body, headers=headers)
+
+    if sample_response.status_code != 202:
+        logger.error('%s << Error uploading sample file for survey %s, period %s', sample_response.status_code,
+                     survey.survey_ref, survey.period)
+        raise Exception('Failed to upload sample')
+
+    sample_summary_id = sample_response.json()['id']
+    logger.info('Successfully uploaded sample file for survey %s, period %s', survey.survey_ref, survey.period)
+
+    poll_until(f'sample summary {sample_summary_id} to be ACTIVE',
+               check=partial(check_sample_summary, client, sample_summary_id),
+               is_ready=lambda state: state == 'ACTIVE',
+               timeout_seconds=SAMPLE_READY_TIMEOUT_SECONDS)
+
+    data = {'sampleSummaryIds': [str(sample_summary_id)]}
+    collection_exercise_url = f"{os.getenv('collection_exercise')}/collectionexercises"
+    collection_exercise = get_collection_exercise(survey.survey_ref, survey.period, collection_exercise_url, client)
+    if collection_exercise:
+        collection_exercise_id = collection_exercise['id']
+        collection_exercise_response = client.put(f'{collection_exercise_url}/link/{collection_exercise_id}', json=data)
+        collection_exercise_response.raise_for_status()
+        logger.info('Successfully linked sample summary with collection exercise %s', survey.period)
+    else:
+        logger.error("failed to link sample summary with collection exercise")
+
+
+def check_sample_summary(client, sample_summary_id):
+    sample_summary_url = f"{os.getenv('sample')}/samples/samplesummary/{sample_summary_id}"
+    check_and_transition_sample_summary_status = client.get(
+        url=f"{sample_summary_url}/check-and-transition-sample-summary-status")
+    logger.info("check_and_transition_sample_summary_status: %s", check_and_transition_sample_summary_status)
+
+    sample_summary = json.loads(client.get(sample_summary_url).text)
+    return sample_summary['state'], sample_summary
+
+
+def generate_sample_rows(size, form_type):
+    for i in range(size):
+        sample_unit_ref = '499' + format(str(i), "0>8s")
+        runame3 = str(i)
+        tradas3 = str(i)
+        region_code = 'WW'
+        yield (sample_unit_ref, 'H', '75110', '75110', '84110', '84110', '3603', '97281', '9905249178', '5', 'E',
+               region_code, '07/08/2003', 'OFFICE FOR', 'NATIONAL STATISTICS', runame3, 'OFFICE FOR',
+               'NATIONAL STATISTICS', tradas3, '', '', '', 'C', '', '1', form_type, 'S')
+
+
+def generate_sample_chunks(size, form_type):
+    # Only ever holds roughly one chunk of the sample in memory, whatever the number of respondents
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=":")
+    for row in generate_sample_rows(size, form_type):
+        writer.writerow(row)
+        if output.tell() >= SAMPLE_CHUNK_BYTES:
+            yield output.getvalue().encode('utf-8')
+            output.seek(0)
+            output.truncate()
+
+    if output.tell():
+        yield output.getvalue().encode('utf-8')
+
+
+def sample_file_chunks(size, survey):
+    if not SAMPLE_FILE_DIRECTORY:
+        return generate_sample_chunks(size, survey.form_type)
+
+    path = os.path.join(SAMPLE_FILE_DIRECTORY,
+                        f'sample_{survey.survey_ref}_{survey.period}_{survey.form_type}_{size}.csv')
+    if os.path.exists(path):
+        logger.info('Reusing sample file %s', path)
+    else:
+        logger.info('Writing generated sample file to %s', path)
+        with open(path + '.tmp', 'wb') as fp:
+            for chunk in generate_sample_chunks(size, survey.form_type):
+                fp.write(chunk)
+        os.replace(path + '.tmp', path)
+
+    return read_file_chunks(path)
+
+
+def read_file_chunks(path):
+    with open(path, 'rb') as fp:
+        for chunk in iter(partial(fp.read, SAMPLE_CHUNK_BYTES), b''):
+            yield chunk
+
+
+# Spooled to a temporary file so the sample never has to be built up in memory, and sent from it rather than from a
+# generator so the admin client's retries can rewind the body and send all of it again
+def multipart_file_body(boundary, file_name, content_type, chunks):
+    body = tempfile.TemporaryFile()
+    body.write((f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="file"; filename="{file_name}"\r\n'
+                f'Content-Type: {content_type}\r\n\r\n').encode('utf-8'))
+    for chunk in chunks:
+        body.write(chunk)
+    body.write(f'\r\n--{boundary}--\r\n'.encode('utf-8'))
+    body.seek(0)
+    return body
+
+
+# Collection exercise execution
+def execute_collection_exercise(client, survey_id, survey):
+    data = poll_until(f'collection exercise {survey.period} on survey {survey.survey_ref} to be READY_FOR_REVIEW',
+                      check=partial(check_collection_exercise, client, survey),
+                      is_ready=lambda state: state == 'READY_FOR_REVIEW',
+                      timeout_seconds=COLLECTION_EXERCISE_READY_TIMEOUT_SECONDS)
+
+    execute_url = f"{os.getenv('collection_exercise')}/collectionexerciseexecution/{data['id']}"
+
+    def execute_when_ready_for_review(previous_state, state):
+        if state == 'READY_FOR_REVIEW':
+            logger.info('Executing collection exercise %s on survey %s ', survey.period, survey.survey_ref)
+            response = client.post(execute_url)
+            response.raise_for_status()
+            logger.info('Collection exercise %s on survey %s executed', survey.period, survey.survey_ref)
+
+    poll_until(f'collection exercise {survey.period} on survey {survey.survey_ref} to be executed',
+               check=partial(check_collection_exercise, client, survey),
+               is_ready=lambda state: state not in (None, 'READY_FOR_REVIEW'),
+               timeout_seconds=COLLECTION_EXERCISE_READY_TIMEOUT_SECONDS,
+               on_transition=execute_when_ready_for_review)
+
+    poll_until(f'collection exercise {survey.period} on survey {survey.survey_ref} to be LIVE',
+               check=partial(check_collection_exercise_live, client, survey),
+               is_ready=lambda state: state == 'LIVE',
+               timeout_seconds=COLLECTION_EXERCISE_LIVE_TIMEOUT_SECONDS)
+
+
+def check_collection_exercise(client, survey):
+    collection_exercise_url = f"{os.getenv('collection_exercise')}/collectionexercises"
+    data = get_collection_exercise(survey.survey_ref, survey.period, collection_exercise_url, client, refresh=True)
+    return (data['state'] if data else None), data
+
+
+def check_collection_exercise_live(client, survey):
+    state, data = check_collection_exercise(client, survey)
+    if state != 'LIVE':
+        logger.info('Executing process-scheduled-events...')
+        process_scheduled_events_url = f"{os.getenv('collection_exercise')}/cron/process-scheduled-events"
+        response = client.get(process_scheduled_events_url)
+        response.raise_for_status()
+    return state, data
+
+
+# Readiness polling
+def poll_until(description, check, is_ready, timeout_seconds, on_transition=None):
+    # check returns a (state, result) pair and is called with exponential backoff plus jitter until is_ready(state)
+    # is true or the deadline passes. on_transition(previous_state, state) is called whenever the state changes
+    start = time.monotonic()
+    deadline = start + timeout_seconds
+    delay = POLL_INITIAL_DELAY_SECONDS
+    previous_state = None
+    attempt = 1
+    while True:
+        state, result = check()
+        elapsed = time.monotonic() - start
+        if attempt == 1 or state != previous_state:
+            logger.info('Waiting for %s: state %s after %.2fs (attempt %s)', description, state, elapsed, attempt)
+            if on_transition:
+                on_transition(previous_state, state)
+            previous_state = state
+
+        if is_ready(state):
+            logger.info('Finished waiting for %s in %.2fs (%s attempts)', description, elapsed, attempt)
+            return result
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.error('Gave up waiting for %s after %.2fs, last state %s', description, elapsed, state)
+            raise Exception(f'Timed out waiting for {description}')
+
+        time.sleep(min(delay / 2 + random.uniform(0, delay / 2), remaining))
+        delay = min(delay * 2, POLL_MAX_DELAY_SECONDS)
+        attempt += 1
+
+
+# Register respondent accounts
+def register_users(client, checkpoint, runner):
+    outstanding = [i for i in range(respondents) if i not in checkpoint.registered]
+    logger.info("Registering %s respondents (%s already registered)", len(outstanding), respondents - len(outstanding))
+
+    if DISTRIBUTED_REGISTRATION and isinstance(runner, MasterRunner):
+        failures = register_users_on_workers(runner, outstanding, checkpoint)
+    else:
+        failures = register_respondents(client, outstanding, checkpoint.complete_registration)
+
+    if failures:
+        raise Exception("Failed to register users")
+
+
+def register_respondents(client, indices, on_registered):
+    logger.info("Registering %s respondents with a concurrency of %s", len(indices), REGISTRATION_CONCURRENCY)
+    stage_timings = defaultdict(list)
+    start = time.perf_counter()
+
+    iac_watcher = IacWatcher(client)
+    iac_watcher.start()
+    pool = Pool(REGISTRATION_CONCURRENCY)
+    registrations = [pool.spawn(register_user, i, client, iac_watcher, stage_timings, on_registered)
+                     for i in indices]
+    pool.join()
+    iac_watcher.stop()
+
+    log_stage_timings(stage_timings)
+    failures = [i for i, registration in zip(indices, registrations) if not registration.successful()]
+    if failures:
+        first_error = next(registration.exception for registration in registrations if not registration.successful())
+        logger.error("%s of %s respondents failed to register, first error: %s", len(failures), len(indices),
+                     first_error)
+
+    logger.info("Registered %s respondents in %.2fs", len(indices) - len(failures), time.perf_counter() - start)
+    return failures
+
+
+# Distributed registration: the master splits the outstanding respondents into shards, one per worker, and waits
+# for every worker to report its shard as done before any users are spawned
+def register_users_on_workers(runner, outstanding, checkpoint):
+    workers = [worker.id for worker in runner.clients.ready]
+    if not workers:
+        logger.warning("No workers ready to register respondents, registering them on the master")
+        return register_respondents(get_admin_client(), outstanding, checkpoint.complete_registration)
+
+    shard_size = -(-len(outstanding) // len(workers))
+    shards = {}
+    for shard, worker in enumerate(workers):
+        indices = outstanding[shard * shard_size:(shard + 1) * shard_size]
+        shards[shard] = indices
+        registration_shards[shard] = AsyncResult()
+        logger.info("Sending %s respondents to worker %s", len(indices), worker)
+        runner.send_message('register_respondents', {'shard': shard, 'ranges': index_ranges(indices)},
+                            client_id=worker)
+
+    failures = []
+    deadline = time.monotonic() + REGISTRATION_SHARD_TIMEOUT_SECONDS
+    for shard, indices in shards.items():
+        try:
+            failed = registration_shards[shard].get(timeout=max(deadline - time.monotonic(), 0))
+        except gevent.Timeout:
+            logger.error("Timed out waiting for shard %s of %s respondents to be registered", shard, len(indices))
+            failed = indices
+        finally:
+            del registration_shards[shard]
+        for i in set(indices) - set(failed):
+            checkpoint.complete_registration(i)
+        failures.extend(failed)
+
+    logger.info("Workers registered %s of %s respondents", len(outstanding) - len(failures), len(outstanding))
+    return failures
+
+
+def index_ranges(indices):
+    ranges = []
+    for i in indices:
+        if ranges and ranges[-1][1] == i:
+            ranges[-1][1] = i + 1
+        else:
+            ranges.append([i, i + 1])
+    return ranges
+
+
+def on_register_respondents(environment, msg, **kwargs):
+    gevent.spawn(register_shard, environment.runner, msg.data['shard'], msg.data['ranges'])
+
+
+def register_shard(runner, shard, ranges):
+    indices = [i for start, end in ranges for i in range(start, end)]
+    logger.info("Registering shard %s of %s respondents", shard, len(indices))
+    try:
+        failed = register_respondents(get_admin_client(), indices, lambda i: None)
+    except Exception:
+        logger.exception("Failed to register shard %s", shard)
+        failed = indices
+    runner.send_message('respondents_registered', {'shard': shard, 'failed': failed})
+
+
+def on_respondents_registered(environment, msg, **kwargs):
+    result = registration_shards.get(msg.data['shard'])
+    if result is not None:
+        result.set(msg.data['failed'])
+
+
+def register_user(i, client, iac_watcher, stage_timings, on_registered):
+    sample_unit_ref = '499' + format(str(i), "0>8s")
+    email_address = sample_unit_ref + "@test.com"
+    logger.info("Attempting to register user %s", email_address)
+
+    with timed_stage(stage_timings, 'party_lookup'):
+        ru_party_id = reference_data.get('party', sample_unit_ref, partial(get_party_id, client, sample_unit_ref))
+
+    with timed_stage(stage_timings, 'iac_polling'):
+        iac = iac_watcher.wait_for_iac(sample_unit_ref, ru_party_id, CASE_IAC_TIMEOUT_SECONDS)
+
+    with timed_stage(stage_timings, 'register'):
+        register_url = f"{os.getenv('party')}/party-api/v1/respondents"
+        data = {'emailAddress': email_address, 'firstName': 'first_name', 'lastName': 'last_name',
+                'password': os.getenv('test_respondent_password'), 'telephone': '09876543210', 'enrolmentCode': iac}
+        register_response = client.post(register_url, json=data)
+        if register_response.status_code != 200:
+            logger.error("Couldn't register user %s because %s > %s", email_address, register_response.status_code,
+                         register_response.text)
+            raise Exception("Failed to register user")
+
+    # TODO: Introduce a frontstage email verification link step rather than direct activation
+
+    with timed_stage(stage_timings, 'activate'):
+        respondent_id = json.loads(register_response.text)['id']
+        activate_payload = {"status_change": "ACTIVE"}
+        activate_url = f"{os.getenv('party')}/party-api/v1/respondents/edit-account-status/{respondent_id}"
+        activate_response = client.put(activate_url, json=activate_payload)
+        activate_response.raise_for_status()
+
+    on_registered(i)
+    logger.info("Successfully registered and activated user %s", email_address)
+
+
+def get_party_id(client, sample_unit_ref):
+    party_ru_url = f"{os.getenv('party')}/party-api/v1/businesses/ref/{sample_unit_ref}"
+    party_response = client.get(party_ru_url)
+    party_response.raise_for_status()
+    return json.loads(party_response.text)['id']
+
+
+def check_case_iac(client, ru_party_id):
+    case_url = f"{os.getenv('case')}/cases/partyid/{ru_party_id}"
+    case_response = client.get(case_url, params={"iac": "true"})
+    case_response.raise_for_status()
+    if case_response.status_code != 200:
+        return 'CASE_NOT_FOUND', None
+
+    iac = json.loads(case_response.text)[0]['iac']
+    return ('IAC_FOUND' if iac is not None else 'IAC_NOT_FOUND'), iac
+
+
+@contextmanager
+def timed_stage(stage_timings, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_timings[stage].append(time.perf_counter() - start)
+
+
+def log_stage_timings(stage_timings):
+    for stage, timings in stage_timings.items():
+        logger.info("Stage %s: count %s, total %.2fs, mean %.2fs, max %.2fs", stage, len(timings), sum(timings),
+                    sum(timings) / len(timings), max(timings))
+
+
+def data_loaded(checkpoint=None):
+    if checkpoint and checkpoint.stages and not checkpoint.is_complete('registration'):
+        logger.info("Loading data because the checkpoint shows an incomplete load")
+        return False
+
+    # Rather than trusting the checkpoint, spot check the first, last and a random sample of respondents
+    client = get_admin_client()
+    sample_size = min(SEED_VERIFY_SAMPLE_SIZE, respondents)
+    indices = {0, respondents - 1} | set(random.sample(range(respondents), sample_size))
+    for i in sorted(indices):
+        email_address = respondent_email(i)
+        url = f"{os.getenv('party')}/party-api/v1/respondents?emailAddress={email_address}"
+        response = client.get(url)
+        if response.status_code != 200:
+            logger.info("Loading data because Party check returned %s", response.status_code)
+            return False
+        data = json.loads(response.text)
+        if data['total'] == 0:
+            logger.info("Loading data because Party polled and %s records found for %s", data['total'], email_address)
+            return False
+        if data['data'][0]['status'] != 'ACTIVE':
+            logger.info("Loading data because %s is set to %s (will probably fail)", email_address,
+                        data['data'][0]['status'])
+            return False
+
+    logger.info("Data already loaded, %s sampled respondents are ACTIVE", len(indices))
+    return True
+
+
+@events.init.add_listener
+def on_locust_init(environment, **kwargs):
+    if isinstance(environment.runner, MasterRunner):
+        environment.runner.register_message('respondents_registered', on_respondents_registered)
+    elif isinstance(environment.runner, WorkerRunner):
+        environment.runner.register_message('register_respondents', on_register_respondents)
+
+    if isinstance(environment.runner, (MasterRunner, LocalRunner)) and SEED_MODE != 'inline':
+        if SEED_MODE == 'background':
+            global seed_greenlet
+            seed_greenlet = gevent.spawn(seed, environment.runner, get_profile())
+        if environment.parsed_options and environment.parsed_options.headless:
+            # Headless runs start the run time clock as soon as init completes, so keep the data load out of it
+            wait_for_seed()
+
+
+# Called on the master when the test starts, before any users are spawned
+def prepare_data(runner):
+    if SEED_MODE == 'inline':
+        seed(runner, get_profile())
+    else:
+        wait_for_seed()
+
+
+def seed(runner, survey):
+    checkpoint = SeedCheckpoint(SEED_CHECKPOINT_FILE, survey, checkpoint_backend())
+    marker = seed_marker(survey) if SEED_MODE == 'external' else None
+    if marker:
+        results_backend().delete(marker)
+    progress = gevent.spawn(report_seed_progress, checkpoint, time.monotonic())
+    try:
+        if not data_loaded(checkpoint):
+            if checkpoint.is_complete('registration'):
+                # The checkpoint only resumes an unfinished load. Once the data it recorded is gone, e.g. after
+                # cleanup.sql, everything has to be loaded again
+                logger.info("Discarding checkpoint %s as its load completed but the data is missing", checkpoint.path)
+                checkpoint.reset()
+            load_data(checkpoint, runner, survey)
+        if marker:
+            results_backend().write_text(marker, json.dumps({**checkpoint.key,
+                                                              'completed': datetime.now(timezone.utc).isoformat()}))
+            logger.info("Marked the data load as complete in %s", marker)
+    finally:
+        progress.kill()
+
+
+def report_seed_progress(checkpoint, start):
+    while True:
+        gevent.sleep(SEED_PROGRESS_INTERVAL_SECONDS)
+        logger.info("Data load running for %.0fs: stages %s complete, %s of %s respondents registered",
+                    time.monotonic() - start, list(checkpoint.stages), len(checkpoint.registered), respondents)
+
+
+def wait_for_seed():
+    # Readiness barrier: users are only spawned once the data load has finished
+    if SEED_MODE == 'background':
+        logger.info("Waiting for the background data load to finish")
+        seed_greenlet.get(timeout=SEED_WAIT_TIMEOUT_SECONDS)
+    elif SEED_MODE == 'external':
+        backend = results_backend()
+        marker = seed_marker(get_profile())
+        # A marker left by an earlier run is only trusted while the data it describes is still there
+        poll_until('data to be loaded by the seed job',
+                   check=lambda: (backend.read_text(marker) is not None and data_loaded(), None),
+                   is_ready=lambda loaded: loaded,
+                   timeout_seconds=SEED_WAIT_TIMEOUT_SECONDS)
+
+
+def seed_marker(survey):
+    return f"{SEED_MARKER_DIRECTORY}/{survey.survey_ref}-{survey.period}-{respondents}.json"
+
+
+def seed_checkpoint_name(survey):
+    return f"{SEED_MARKER_DIRECTORY}/{survey.survey_ref}-{survey.period}-{respondents}-checkpoint.jsonl"
+
+
+# Without a backend, e.g. running locally without GCS credentials, the checkpoint is only kept in SEED_CHECKPOINT_FILE
+def checkpoint_backend():
+    try:
+        return results_backend()
+    except Exception as e:
+        logger.warning("Only checkpointing the data load to %s as the results backend isn't available: %s",
+                       SEED_CHECKPOINT_FILE, e)
+        return None
+
+
+# Shared client for the admin API calls made while loading data. Keeps a keep-alive connection pool per service,
+# retries with backoff and caps the number of requests in flight across all loading greenlets
+class AdminClient:
+
+    def __init__(self, auth):
+        self.auth = auth
+        self.sessions = {}
+        self.semaphore = BoundedSemaphore(ADMIN_MAX_CONCURRENCY)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        with self.semaphore:
+            return self._session_for(url).request(method, url, **kwargs)
+
+    def _session_for(self, url):
+        service = urlsplit(url).netloc
+        session = self.sessions.get(service)
+        if session is None:
+            retries = Retry(total=ADMIN_MAX_RETRIES, backoff_factor=ADMIN_RETRY_BACKOFF_SECONDS,
+                            status_forcelist=[502, 503, 504], raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=ADMIN_POOL_SIZE, max_retries=retries)
+            session = requests.Session()
+            session.auth = self.auth
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.sessions[service] = session
+        return session
+
+
+def get_admin_client():
+    global admin_client
+    if admin_client is None:
+        admin_client = AdminClient(auth=(os.getenv('security_user_name'), os.getenv('security_user_password')))
+    return admin_client
+
+
+# Watches the cases of every respondent waiting to register, polling a batch of them each interval in rotation and
+# handing each IAC over as soon as it appears. Load on the case service depends on how long we wait, not on the
+# number of respondents
+class IacWatcher:
+
+    def __init__(self, client):
+        self.client = client
+        self.pending = deque()
+        self.waiting = {}
+        self.greenlet = None
+
+    def start(self):
+        self.greenlet = gevent.spawn(self._watch)
+
+    def stop(self):
+        self.greenlet.kill()
+
+    def wait_for_iac(self, sample_unit_ref, ru_party_id, timeout_seconds):
+        result = AsyncResult()
+        self.waiting[ru_party_id] = result
+        self.pending.append(ru_party_id)
+        try:
+            return result.get(timeout=timeout_seconds)
+        except gevent.Timeout:
+            logger.error("Case never found for %s", sample_unit_ref)
+            raise Exception("Case not found")
+        finally:
+            self.waiting.pop(ru_party_id, None)
+
+    def _watch(self):
+        while True:
+            batch = [self.pending.popleft() for _ in range(min(IAC_WATCH_BATCH_SIZE, len(self.pending)))]
+            checks = [(ru_party_id, gevent.spawn(check_case_iac, self.client, ru_party_id)) for ru_party_id in batch]
+            gevent.joinall([check for _, check in checks])
+
+            found = 0
+            for ru_party_id, check in checks:
+                result = self.waiting.get(ru_party_id)
+                if result is None:
+                    continue
+                if not check.successful():
+                    result.set_exception(check.exception)
+                    continue
+                state, iac = check.value
+                if state == 'IAC_FOUND':
+                    result.set(iac)
+                    found += 1
+                else:
+                    self.pending.append(ru_party_id)
+
+            if batch:
+                logger.info('Checked %s cases for IACs, %s found, %s still pending', len(batch), found,
+                            len(self.pending))
+            gevent.sleep(IAC_WATCH_INTERVAL_SECONDS)
+
+
+# Caches reference data that can't change during a run (survey IDs, collection exercise IDs, party IDs) so it's only
+# fetched once. Anything mutable, like a collection exercise's state, must be refreshed by invalidating its entry
+class ReferenceDataCache:
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, key, fetch):
+        if (kind, key) in self.entries:
+            self.hits += 1
+            return self.entries[(kind, key)]
+
+        self.misses += 1
+        value = fetch()
+        if value is not None:
+            self.entries[(kind, key)] = value
+        return value
+
+    def invalidate(self, kind, key):
+        self.entries.pop((kind, key), None)
+
+
+reference_data = ReferenceDataCache()
+
+
+# Append-only record of the data loading stages and respondent registrations that have completed, so an interrupted
+# load resumes from where it stopped. It's kept in a local file and copied to the backend, and whichever of the two
+# holds more of the load is resumed from. A checkpoint written for a different survey, period or respondent count is
+# discarded
+class SeedCheckpoint:
+
+    def __init__(self, path, survey, backend=None):
+        self.path = path
+        self.key = {'survey_ref': survey.survey_ref, 'period': survey.period, 'respondents': respondents}
+        self.backend = backend
+        self.name = seed_checkpoint_name(survey)
+        self.synced = 0
+        self.stages = {}
+        self.registered = set()
+        self._load()
+
+    def is_complete(self, stage):
+        return stage in self.stages
+
+    def stage_result(self, stage):
+        return self.stages[stage]
+
+    def complete_stage(self, stage, result=None):
+        self.stages[stage] = result
+        self._append({'stage': stage, 'result': result})
+        self._sync()
+
+    def complete_registration(self, i):
+        self.registered.add(i)
+        self._append({'registered': i})
+        if time.monotonic() - self.synced >= SEED_CHECKPOINT_SYNC_SECONDS:
+            self._sync()
+
+    def reset(self):
+        self.stages = {}
+        self.registered = set()
+        self.fp.close()
+        self._write()
+
+    def _load(self):
+        local = (self.path, [])
+        if os.path.exists(self.path):
+            with open(self.path) as fp:
+                local = (self.path, self._parse(fp.read(), self.path))
+        stored = (None, [])
+        if self.backend:
+            location = self.backend.location(self.name)
+            try:
+                stored = (location, self._parse(self.backend.read_text(self.name) or '', location))
+            except Exception as e:
+                logger.warning("Couldn't read checkpoint %s: %s", location, e)
+        location, records = max((stored, local), key=lambda checkpoint: (checkpoint[1][:1] == [{'key': self.key}],
+                                                                          len(checkpoint[1])))
+
+        if records and records[0].get('key') == self.key:
+            for record in records[1:]:
+                if 'stage' in record:
+                    self.stages[record['stage']] = record['result']
+                elif 'registered' in record:
+                    self.registered.add(record['registered'])
+            logger.info("Resuming from checkpoint %s: stages %s complete, %s respondents registered", location,
+                        list(self.stages), len(self.registered))
+        elif records:
+            logger.info("Discarding checkpoint %s as it was written for %s", location, records[0].get('key'))
+
+        # Rewrite the checkpoint so any entry cut short by a crash doesn't corrupt the ones appended after it
+        self._write()
+
+    def _parse(self, text, location):
+        records = []
+        for line in text.splitlines():
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning("Ignoring unreadable checkpoint entry in %s", location)
+        return records
+
+    def _write(self):
+        with open(self.path + '.tmp', 'w') as fp:
+            fp.write(json.dumps({'key': self.key}) + '\n')
+            for stage, result in self.stages.items():
+                fp.write(json.dumps({'stage': stage, 'result': result}) + '\n')
+            for i in sorted(self.registered):
+                fp.write(json.dumps({'registered': i}) + '\n')
+        os.replace(self.path + '.tmp', self.path)
+        self.fp = open(self.path, 'a')
+        self._sync()
+
+    def _append(self, record):
+        self.fp.write(json.dumps(record) + '\n')
+        self.fp.flush()
+
+    def _sync(self):
+        self.synced = time.monotonic()
+        if not self.backend:
+            return
+        try:
+            with open(self.path) as fp:
+                self.backend.write_text(self.name, fp.read())
+        except Exception as e:
+            logger.warning("Couldn't copy checkpoint to %s: %s", self.backend.location(self.name), e)
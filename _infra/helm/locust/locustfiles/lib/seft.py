@@ -0,0 +1,315 @@
+import csv
+import hashlib
+import io
+import os
+import re
+import time
+import zipfile
+from collections import defaultdict
+
+from locust import events, task
+from locust.runners import LocalRunner, WorkerRunner
+
+from lib.config import LOCUSTFILE_DIRECTORY, logger, r
+from lib.frontstage import FrontstageTasks
+from lib.phases import start_phases
+from lib.profiles import get_profile
+from lib.results import results_writer
+
+# Upload payloads are built once per worker and shared by every user. upload_sizes adds generated spreadsheets to the
+# real SEFT file, picked by weight, e.g. '10KB:5,1MB:3,20MB:1'. Set upload_file_weight to 0 to only send generated ones
+UPLOAD_FILE = os.getenv('upload_file') or get_profile().seft_file
+UPLOAD_FILE_WEIGHT = int(os.getenv('upload_file_weight', 1))
+UPLOAD_SIZES = os.getenv('upload_sizes', '')
+UPLOAD_SIZE_REGEX = re.compile(r'(\d+(?:\.\d+)?)(B|KB|MB)')
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# The smallest set of parts a reader will open as a workbook, alongside xl/worksheets/sheet1.xml
+SPREADSHEET_PARTS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>',
+}
+upload_payloads = None
+# download_mode 'stream' reads the survey download in chunks rather than buffering it, checks the bytes received against
+# Content-Length and, if set, download_sha256, and reports the request with the time and size of the full download.
+# Time to first byte and bytes/s per download are written to DOWNLOAD_STATS_FILE when the test finishes
+DOWNLOAD_MODE = os.getenv('download_mode', 'buffered')
+DOWNLOAD_CHUNK_BYTES = int(os.getenv('download_chunk_bytes', 64 * 1024))
+DOWNLOAD_SHA256 = os.getenv('download_sha256')
+# Expected Content-Length header of the survey download, left empty to skip the check
+DOWNLOAD_CONTENT_LENGTH = os.getenv('download_content_length', '39')
+DOWNLOAD_STATS_FILE = 'rasrm_download_stats.csv'
+# Download count, bytes, seconds and seconds to first byte per grouping. Workers send theirs to the master with their
+# stats reports
+download_stats = defaultdict(lambda: [0, 0, 0.0, 0.0])
+
+
+@events.init.add_listener
+def on_locust_init(environment, **kwargs):
+    if isinstance(environment.runner, (WorkerRunner, LocalRunner)):
+        get_upload_payloads()
+
+
+def get_upload_payloads():
+    global upload_payloads
+    if upload_payloads is None:
+        payloads = []
+        if UPLOAD_FILE_WEIGHT:
+            with open(LOCUSTFILE_DIRECTORY + UPLOAD_FILE, 'rb') as upload_file:
+                payloads.append(("/surveys/upload-survey", upload_file.read(), UPLOAD_FILE_WEIGHT))
+        for upload_size in filter(None, UPLOAD_SIZES.replace(' ', '').split(',')):
+            label, _, weight = upload_size.upper().partition(':')
+            payloads.append((f"/surveys/upload-survey ({label})", generate_spreadsheet(parse_size(label)),
+                             int(weight or 1)))
+        if not payloads:
+            raise Exception("No upload payloads configured, check upload_file_weight and upload_sizes")
+        logger.info("Upload payloads ready: %s", {grouping: len(payload) for grouping, payload, _ in payloads})
+        upload_payloads = payloads
+    return upload_payloads
+
+
+def parse_size(label):
+    match = UPLOAD_SIZE_REGEX.fullmatch(label)
+    if not match:
+        raise Exception(f"Invalid upload size {label}, expected a number followed by B, KB or MB")
+    return int(float(match.group(1)) * {'B': 1, 'KB': 1024, 'MB': 1024 * 1024}[match.group(2)])
+
+
+def generate_spreadsheet(size):
+    # Cells are random so the workbook doesn't compress, and parts are stored uncompressed so its size is predictable
+    rows = []
+    padding = size - len(build_spreadsheet(''))
+    row = 0
+    while padding > 0:
+        row += 1
+        cells = f'<row r="{row}"><c r="A{row}" t="inlineStr"><is><t>{r.getrandbits(256):064x}</t></is></c></row>'
+        rows.append(cells)
+        padding -= len(cells)
+    return build_spreadsheet(''.join(rows))
+
+
+def build_spreadsheet(rows):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as spreadsheet:
+        for name, content in SPREADSHEET_PARTS.items():
+            spreadsheet.writestr(name, content)
+        spreadsheet.writestr('xl/worksheets/sheet1.xml',
+                             '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                             '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                             f'<sheetData>{rows}</sheetData></worksheet>')
+    return buffer.getvalue()
+
+
+def iter_response_chunks(response, chunk_size):
+    if hasattr(response, 'iter_content'):
+        yield from response.iter_content(chunk_size)
+    elif getattr(response, '_cached_content', None) is not None:
+        # geventhttpclient reads the whole body when the response is wrapped for catch_response
+        content = response._cached_content
+        for offset in range(0, len(content), chunk_size):
+            yield content[offset:offset + chunk_size]
+    else:
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def record_download(grouping, size, first_byte_seconds, seconds):
+    totals = download_stats[grouping]
+    totals[0] += 1
+    totals[1] += size
+    totals[2] += seconds
+    totals[3] += first_byte_seconds
+
+
+@events.report_to_master.add_listener
+def on_report_to_master(client_id, data, **kwargs):
+    data['downloads'] = dict(download_stats)
+    download_stats.clear()
+
+
+@events.worker_report.add_listener
+def on_worker_report(client_id, data, **kwargs):
+    for grouping, (count, size, seconds, first_byte_seconds) in data.get('downloads', {}).items():
+        totals = download_stats[grouping]
+        totals[0] += count
+        totals[1] += size
+        totals[2] += seconds
+        totals[3] += first_byte_seconds
+
+
+@results_writer
+def write_download_stats(file_name=DOWNLOAD_STATS_FILE):
+    if not download_stats:
+        return None
+    with open(file_name, 'w', newline='') as stats_file:
+        writer = csv.writer(stats_file)
+        writer.writerow(['Name', 'Download Count', 'Bytes', 'Average Time To First Byte (ms)',
+                         'Average Download Time (ms)', 'Bytes/s'])
+        for grouping, (count, size, seconds, first_byte_seconds) in sorted(download_stats.items()):
+            writer.writerow([grouping, count, size, round(first_byte_seconds / count * 1000),
+                             round(seconds / count * 1000), round(size / seconds) if seconds else 0])
+            logger.info("%s: %s downloads, %.0f bytes/s, %.0fms to first byte", grouping, count,
+                        size / seconds if seconds else 0, first_byte_seconds / count * 1000)
+    return file_name
+
+
+# Signs in, downloads the SEFT spreadsheet from the survey's page and uploads a completed one, the way a respondent
+# returning a SEFT survey would
+class SeftTasks(FrontstageTasks):
+
+    def on_start(self):
+        super().on_start()
+        self.response = self.get(url="/surveys/todo",
+                                 grouping="/surveys/todo",
+                                 expected_response_text="Click on the survey name to complete your questionnaire",
+                                 expected_response_status=200)
+        request_url = self.page().link_href(get_profile().long_name)
+
+        if request_url is not None:
+            self.return_survey(request_url)
+
+    @task
+    def perform_requests(self):
+        self.pace('iteration')
+        survey = get_profile()
+        request_url = None
+        while request_url is None:
+            self.response = self.get(url="/surveys/history",
+                                     grouping="/surveys/history",
+                                     expected_response_text=survey.long_name,
+                                     expected_response_status=200)
+
+            request_url = self.page().link_href(survey.long_name)
+            if request_url is None:
+                time.sleep(1)
+
+        self.return_survey(request_url)
+
+    def return_survey(self, url):
+        self.response = self.get(url=url,
+                                 grouping="/surveys/access-survey",
+                                 expected_response_text=f"{get_profile().short_name} spreadsheet for",
+                                 expected_response_status=200)
+        request_url_download = self.page().find(id="download_survey_button").attrs.get('href')
+        request_url_upload = self.page().find(id="surveys_upload_form").attrs.get('action')
+
+        self.download_survey(request_url_download)
+
+        self.upload_survey(request_url_upload)
+
+    def download_survey(self, url):
+        expected = {
+            'expected_response_text': "US006: Load SEFT Collection Instruments",
+            'expected_content_disposition': f"attachment; filename={get_profile().seft_file}",
+            'expected_content_type': XLSX_CONTENT_TYPE,
+            'expected_content_length': DOWNLOAD_CONTENT_LENGTH or None,
+        }
+        if DOWNLOAD_MODE == 'stream':
+            self.response = self.download(url, "/surveys/download-survey", expected_sha256=DOWNLOAD_SHA256, **expected)
+        else:
+            self.response = self.get(url, "/surveys/download-survey", **expected)
+
+    def upload_survey(self, url):
+        payloads = get_upload_payloads()
+        grouping, payload, _ = r.choices(payloads, weights=[weight for _, _, weight in payloads])[0]
+        self.response = self.post(url=url,
+                                  grouping=grouping,
+                                  expected_response_text="File uploaded successfully",
+                                  expected_response_status=200,
+                                  files={"file": (os.path.basename(UPLOAD_FILE), payload, XLSX_CONTENT_TYPE)})
+
+    # Streams the body in chunks so memory doesn't grow with the size of the file, keeping only the start of it to check
+    # expected_response_text against. The request is only reported once the body has been read and checked, so its
+    # response time covers the whole download. That means geventhttpclient reads the body up front rather than streaming
+    def download(
+        self,
+        url: str,
+        grouping: str,
+        expected_response_text: str=None,
+        expected_content_disposition: str=None,
+        expected_content_type: str=None,
+        expected_content_length: str=None,
+        expected_sha256: str=None,
+    ):
+        self.pace('request')
+        started = time.monotonic()
+        phases = start_phases(self.client)
+        with self.client.get(url=url, name=grouping, allow_redirects=False, stream=True,
+                             catch_response=True) as response:
+            # geventhttpclient has already read the body by now, so prefer when the headers arrived if that was timed
+            first_byte = time.monotonic()
+            if phases.headers is not None:
+                first_byte = started + phases.headers - phases.started
+            size = 0
+            error = None
+            if response.status_code != 200:
+                error = f"Expected a 200 but got a {response.status_code} for url {url}"
+            elif expected_content_disposition and expected_content_disposition != response.headers.get('Content-Disposition'):
+                error = f"Expected content disposition {expected_content_disposition} does not match returned header"
+            elif expected_content_type and expected_content_type != response.headers.get('Content-type'):
+                error = f"Expected content type {expected_content_type} does not match returned header"
+            elif expected_content_length and expected_content_length != response.headers.get('Content-Length'):
+                error = f"Expected content length {expected_content_length} does not match returned header"
+            else:
+                head = b''
+                digest = hashlib.sha256() if expected_sha256 else None
+                for chunk in iter_response_chunks(response, DOWNLOAD_CHUNK_BYTES):
+                    if size < DOWNLOAD_CHUNK_BYTES:
+                        head += chunk[:DOWNLOAD_CHUNK_BYTES - size]
+                    size += len(chunk)
+                    if digest:
+                        digest.update(chunk)
+
+                if response.headers.get('Content-Length') and int(response.headers['Content-Length']) != size:
+                    error = f"Received {size} bytes but Content-Length was {response.headers['Content-Length']} for url {url}"
+                elif digest and digest.hexdigest() != expected_sha256:
+                    error = f"SHA-256 {digest.hexdigest()} doesn't match {expected_sha256} for url {url}"
+                elif expected_response_text and expected_response_text not in head.decode('utf-8', errors='replace'):
+                    error = f"response text ({expected_response_text}) isn't in the start of the download"
+            finished = time.monotonic()
+            phases.finish("GET", grouping)
+
+            # Reported once, when the context exits, with the time and size of the whole download
+            response.request_meta['response_time'] = (finished - started) * 1000
+            response.request_meta['response_length'] = size
+            if error:
+                response.failure(error)
+                if hasattr(response, 'close'):
+                    response.close()
+                else:
+                    response.release()
+            else:
+                response.success()
+                record_download(grouping, size, first_byte - started, finished - started)
+        if error:
+            self.interrupt()
+        self.report_corrected_latency("GET", grouping, started)
+        self.think()
+        return response
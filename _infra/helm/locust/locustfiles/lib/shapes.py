@@ -0,0 +1,129 @@
+import csv
+import json
+import os
+import time
+from typing import NamedTuple
+
+from locust import LoadTestShape
+from locust.stats import calculate_response_time_percentile, diff_response_time_dicts
+
+from lib.config import LOCUSTFILE_DIRECTORY, logger
+
+# Stage file (JSON or YAML) in the locustfiles directory that replaces the flat user count with ramp, step, spike, hold
+# and soak stages. Per-stage request stats are written to STAGE_STATS_FILE
+LOAD_SHAPE_FILE = os.getenv('load_shape_file')
+STAGE_STATS_FILE = 'rasrm_stage_stats.csv'
+
+
+def load_stages(file_name):
+    path = LOCUSTFILE_DIRECTORY + file_name
+    logger.info("Retrieving load stages from: %s", path)
+    with open(path, encoding='utf-8') as stage_file:
+        if file_name.endswith(('.yaml', '.yml')):
+            import yaml
+            stages = yaml.safe_load(stage_file)['stages']
+        else:
+            stages = json.load(stage_file)['stages']
+
+    compiled = []
+    elapsed = 0
+    # Users at the end of the stage before, which a ramp's default spawn rate is worked out from
+    previous_users = 0
+    for index, stage in enumerate(stages):
+        name = stage.get('name', f"stage {index}")
+        try:
+            if stage.get('type') == 'ramp':
+                duration = float(stage['duration'])
+                spawn_rate = stage.get('spawn_rate') or abs(int(stage['users']) - previous_users) / duration or 1
+                segments = [(duration, int(stage['users']), spawn_rate)]
+            elif stage.get('type') == 'step':
+                segments = [(float(stage['step_duration']),
+                             int(stage['start_users']) + step * int(stage['step_users']),
+                             stage.get('spawn_rate', int(stage['step_users'])))
+                            for step in range(int(stage['steps']))]
+            elif stage.get('type') in ('hold', 'spike', 'soak'):
+                segments = [(float(stage['duration']), int(stage['users']), stage.get('spawn_rate', int(stage['users'])))]
+            else:
+                raise Exception(f"Stage {index} ({name}) in {path} has unknown type {stage.get('type')}")
+        except KeyError as e:
+            raise Exception(f"Stage {index} ({name}) in {path} is missing {e}")
+
+        for duration, users, spawn_rate in segments:
+            elapsed += duration
+            compiled.append(LoadStage(name=name, end=elapsed, users=users, spawn_rate=max(float(spawn_rate), 0.1)))
+        previous_users = compiled[-1].users
+    return tuple(compiled)
+
+
+class LoadStage(NamedTuple):
+    name: str
+    end: float
+    users: int
+    spawn_rate: float
+
+
+# Locust only runs with a LoadTestShape it finds in the locustfile, so the locustfile imports this when LOAD_SHAPE_FILE
+# is set
+class StagedLoadShape(LoadTestShape):
+
+    def __init__(self):
+        super().__init__()
+        self.stages = load_stages(LOAD_SHAPE_FILE)
+        self.stage_stats = StageStats(STAGE_STATS_FILE)
+
+    def reset_time(self):
+        super().reset_time()
+        self.stage_stats.reset()
+
+    def tick(self):
+        run_time = self.get_run_time()
+        stage = next((stage for stage in self.stages if run_time < stage.end), None)
+        if stage is None:
+            return None
+        if stage.name != self.stage_stats.stage:
+            logger.info("Starting load stage %s: %s users at %s/s", stage.name, stage.users, stage.spawn_rate)
+            self.stage_stats.start(self.runner.stats, stage.name)
+        return stage.users, stage.spawn_rate
+
+
+# Splits the run's request stats by load stage, using the difference between cumulative stats at each stage boundary
+class StageStats:
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.stage = None
+        self.started = None
+        self.snapshot = {}
+
+    # Locust resets the shape's time as each test starts, which is when the file is started again with just its header,
+    # so a test run again from the web UI doesn't append to the last one's stages
+    def reset(self):
+        with open(self.file_name, 'w', newline='') as stage_file:
+            csv.writer(stage_file).writerow(['Stage', 'Type', 'Name', 'Request Count', 'Failure Count', '50%', '95%',
+                                             '99%', 'Requests/s'])
+
+    def start(self, stats, stage):
+        self.finish(stats)
+        self.stage = stage
+        self.started = time.monotonic()
+        self.snapshot = {key: (entry.num_requests, entry.num_failures, dict(entry.response_times))
+                         for key, entry in stats.entries.items()}
+
+    def finish(self, stats):
+        if self.stage is None:
+            return
+        duration = time.monotonic() - self.started
+        with open(self.file_name, 'a', newline='') as stage_file:
+            writer = csv.writer(stage_file)
+            for (name, method), entry in stats.entries.items():
+                num_requests, num_failures, response_times = self.snapshot.get((name, method), (0, 0, {}))
+                count = entry.num_requests - num_requests
+                if count <= 0:
+                    continue
+                stage_times = diff_response_time_dicts(entry.response_times, response_times)
+                writer.writerow([self.stage, method, name, count, entry.num_failures - num_failures,
+                                 *(calculate_response_time_percentile(stage_times, count, percent)
+                                   for percent in (0.5, 0.95, 0.99)),
+                                 round(count / duration, 2) if duration else 0])
+        self.stage = None
+
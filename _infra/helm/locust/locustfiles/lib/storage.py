@@ -0,0 +1,162 @@
+import gzip
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+from functools import partial
+from gevent.pool import Pool
+
+from lib.config import logger
+
+# Where results go when the test stops: 'gcs' uploads them to GCS_BUCKET_NAME, 'local' copies them into
+# results_directory, which lets the upload be tried out without a bucket
+RESULTS_BACKEND = os.getenv('results_backend', 'gcs')
+RESULTS_DIRECTORY = os.getenv('results_directory', 'results')
+# Results are gzipped before upload and stored as '<name>.gz' when enabled, which mostly matters for the stats history
+# of long soak runs
+RESULTS_GZIP = os.getenv('results_gzip', 'false').lower() == 'true'
+RESULTS_UPLOAD_CONCURRENCY = int(os.getenv('results_upload_concurrency', 4))
+RESULTS_UPLOAD_RETRIES = int(os.getenv('results_upload_retries', 3))
+RESULTS_UPLOAD_RETRY_BACKOFF_SECONDS = float(os.getenv('results_upload_retry_backoff_seconds', 1))
+RESULTS_CHUNK_BYTES = 1024 * 1024
+
+
+def results_backend():
+    return LocalDirectory(RESULTS_DIRECTORY) if RESULTS_BACKEND == 'local' else GoogleCloudStorage()
+
+
+# Uploads the files that exist under one prefix for the run, several at a time, and returns the ones that failed
+def upload_results(file_names):
+    backend = results_backend()
+    prefix = results_prefix()
+    start = time.monotonic()
+
+    uploads = {}
+    pool = Pool(RESULTS_UPLOAD_CONCURRENCY)
+    for file_name in file_names:
+        if not os.path.exists(file_name):
+            logger.warning("Not uploading %s as it wasn't written", file_name)
+            continue
+        uploads[file_name] = pool.spawn(upload_result, backend, prefix, file_name)
+    pool.join()
+
+    failures = [file_name for file_name, upload in uploads.items() if upload.value is None]
+    logger.info("Uploaded %s of %s results to %s in %.1fs", len(uploads) - len(failures), len(uploads),
+                backend.location(prefix), time.monotonic() - start)
+    return failures
+
+
+# Minute resolution keeps the results of a run together and sorted in the bucket, the suffix stops two runs started in
+# the same minute writing over each other
+def results_prefix():
+    return datetime.utcnow().strftime("%y-%m-%d-%H-%M") + "-" + uuid.uuid4().hex[:6]
+
+
+# Returns the MD5 of what was uploaded, or None once the retries have run out
+def upload_result(backend, prefix, file_name):
+    path, name = (compress(file_name), file_name + '.gz') if RESULTS_GZIP else (file_name, file_name)
+    try:
+        for attempt in range(RESULTS_UPLOAD_RETRIES + 1):
+            try:
+                md5 = backend.upload(path, f"{prefix}/{name}")
+                logger.info("Uploaded %s (%s bytes, md5 %s)", name, os.path.getsize(path), md5)
+                return md5
+            except Exception as e:
+                if attempt == RESULTS_UPLOAD_RETRIES:
+                    logger.error("Failed to upload %s: %s", name, e)
+                    return None
+                delay = RESULTS_UPLOAD_RETRY_BACKOFF_SECONDS * 2 ** attempt
+                logger.warning("Upload of %s failed (%s), retrying in %.1fs", name, e, delay)
+                time.sleep(delay)
+    finally:
+        if path != file_name:
+            os.remove(path)
+
+
+def compress(file_name):
+    with open(file_name, 'rb') as source, gzip.open(file_name + '.gz', 'wb') as target:
+        shutil.copyfileobj(source, target, RESULTS_CHUNK_BYTES)
+    return file_name + '.gz'
+
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as fp:
+        for chunk in iter(partial(fp.read, RESULTS_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class GoogleCloudStorage:
+
+    def __init__(self):
+        # Only the master uploads results, so the client library is only imported once there's something to upload
+        from google.cloud import storage
+        self.project_id = os.getenv('GOOGLE_CLOUD_PROJECT')
+        self.bucket_name = os.getenv('GCS_BUCKET_NAME')
+        self.client = storage.Client(project=self.project_id)
+        self.bucket = self.client.bucket(self.bucket_name)
+
+    def location(self, prefix):
+        return f"gs://{self.bucket_name}/{prefix}"
+
+    # Streams the file from disk, and the client checks the MD5 it calculates on the way against the one GCS stored
+    def upload(self, path, name):
+        blob = self.bucket.blob(name)
+        content_type = 'application/gzip' if name.endswith('.gz') else 'application/csv'
+        blob.upload_from_filename(path, content_type=content_type, checksum='md5')
+        return file_md5(path)
+
+    def read_text(self, name):
+        blob = self.bucket.get_blob(name)
+        return None if blob is None else blob.download_as_text()
+
+    def write_text(self, name, text):
+        self.bucket.blob(name).upload_from_string(text, content_type='application/json')
+
+    def delete(self, name):
+        blob = self.bucket.get_blob(name)
+        if blob is not None:
+            blob.delete()
+
+
+# Stand in for the bucket that copies results into a local directory, checking the copy against the original
+class LocalDirectory:
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def location(self, prefix):
+        return os.path.join(self.directory, prefix)
+
+    def upload(self, path, name):
+        target = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(path, target + '.tmp')
+        md5 = file_md5(path)
+        if file_md5(target + '.tmp') != md5:
+            os.remove(target + '.tmp')
+            raise Exception(f"Copy of {path} in {self.directory} doesn't match the original")
+        os.replace(target + '.tmp', target)
+        return md5
+
+    def read_text(self, name):
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as fp:
+            return fp.read()
+
+    def write_text(self, name, text):
+        target = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target + '.tmp', 'w') as fp:
+            fp.write(text)
+        os.replace(target + '.tmp', target)
+
+    def delete(self, name):
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,334 @@
+import argparse
+import csv
+import gzip
+import io
+import logging
+import math
+import os
+import re
+import sys
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger()
+
+STATS_FILE = 'rasrm_stats.csv'
+STATS_HISTORY_FILE = 'rasrm_stats_history.csv'
+# Results are uploaded under a '%y-%m-%d-%H-%M' prefix of the UTC time, with a random suffix since runs could start in
+# the same minute
+RESULTS_PREFIX_FORMAT = '%y-%m-%d-%H-%M'
+RESULTS_PREFIX_REGEX = re.compile(r'^\d{2}-\d{2}-\d{2}-\d{2}-\d{2}(-[0-9a-f]{6})?$')
+LOCUST_PERCENTILES = (50, 66, 75, 80, 90, 95, 98, 99, 99.9, 99.99, 100)
+COMPARED_PERCENTILES = (50, 95, 99)
+
+
+# Compares a run's stats against a baseline run, e.g.
+#   python compare_results.py --baseline gs://ras-rm-performance-20220908-locust
+# and exits with 1 when any grouping has regressed by more than the thresholds, and significantly so
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare Locust results against a baseline run")
+    parser.add_argument('--current', default='.',
+                        help="directory or gs://bucket/prefix with this run's results (default: the working directory)")
+    parser.add_argument('--baseline', required=True,
+                        help="directory or gs://bucket/prefix with the baseline's results. When it holds results "
+                             "prefixes rather than results, the latest one older than the current run is used")
+    parser.add_argument('--current-prefix',
+                        help="results prefix the current run was uploaded under, which baselines have to be older "
+                             "than (default: the current results' own prefix, or else when the run started)")
+    parser.add_argument('--latency-threshold', type=float, default=0.1,
+                        help="relative increase in p50/p95/p99 that counts as a regression (default: 0.1)")
+    parser.add_argument('--throughput-threshold', type=float, default=0.1,
+                        help="relative drop in requests/s that counts as a regression (default: 0.1)")
+    parser.add_argument('--failure-rate-threshold', type=float, default=0.01,
+                        help="increase in the fraction of requests failing that counts as a regression "
+                             "(default: 0.01)")
+    parser.add_argument('--alpha', type=float, default=0.01,
+                        help="significance level a regression has to reach (default: 0.01)")
+    parser.add_argument('--min-requests', type=int, default=100,
+                        help="groupings with fewer requests than this in either run aren't judged (default: 100)")
+    parser.add_argument('--output', help="also write the comparison to this CSV file")
+    args = parser.parse_args(argv)
+
+    current = open_results(args.current)
+    current_run = read_history(current)
+    baseline = open_results(args.baseline, before=baseline_cutoff(args.current_prefix, current, current_run))
+    logger.info("Comparing %s against baseline %s", current.location, baseline.location)
+
+    baseline_run = read_history(baseline)
+    logger.info("Current run: %ss at up to %s users, baseline: %ss at up to %s users", current_run.duration,
+                current_run.users, baseline_run.duration, baseline_run.users)
+    if current_run.users != baseline_run.users:
+        logger.warning("The runs had different user counts, so their throughput and latency may not be comparable")
+
+    comparisons = compare(read_stats(current), read_stats(baseline), args)
+    print_comparisons(comparisons)
+    if args.output:
+        write_comparisons(args.output, comparisons)
+
+    regressions = [comparison for comparison in comparisons if comparison.regression]
+    for comparison in regressions:
+        logger.error("Regression in %s %s %s: %s -> %s (p=%.4f)", comparison.method, comparison.name,
+                     comparison.metric, comparison.baseline, comparison.current, comparison.p_value)
+    logger.info("%s regressions in %s comparisons", len(regressions), len(comparisons))
+    return 1 if regressions else 0
+
+
+class GroupingStats(NamedTuple):
+    requests: int
+    failures: int
+    requests_per_second: float
+    percentiles: dict
+
+
+class RunSummary(NamedTuple):
+    duration: int
+    users: int
+    started: int
+
+
+class Comparison(NamedTuple):
+    method: str
+    name: str
+    metric: str
+    baseline: float
+    current: float
+    change: float
+    p_value: float
+    regression: bool
+
+
+def open_results(location, before=None):
+    if location.startswith('gs://'):
+        bucket_name, _, prefix = location[len('gs://'):].partition('/')
+        source = BucketResults(bucket_name, prefix.strip('/'))
+    else:
+        source = LocalResults(location)
+
+    if source.find(STATS_FILE) is None:
+        prefixes = sorted(prefix for prefix in source.prefixes()
+                          if RESULTS_PREFIX_REGEX.match(prefix) and (before is None or _prefix_time(prefix) < before))
+        if not prefixes:
+            raise Exception(f"No {STATS_FILE} or results prefixes in {location}")
+        source = source.child(prefixes[-1])
+        if source.find(STATS_FILE) is None:
+            raise Exception(f"No {STATS_FILE} in {source.location}")
+    return source
+
+
+# The current run's own upload is usually the latest prefix next to the baselines, so a baseline has to have been
+# uploaded in a minute before it, or before the run started when its prefix isn't known
+def baseline_cutoff(current_prefix, current, current_run):
+    if current_prefix:
+        if not RESULTS_PREFIX_REGEX.match(current_prefix):
+            raise Exception(f"{current_prefix} isn't a results prefix")
+        return _prefix_time(current_prefix)
+    if RESULTS_PREFIX_REGEX.match(current.prefix):
+        return _prefix_time(current.prefix)
+    if current_run.started:
+        return datetime.fromtimestamp(current_run.started, timezone.utc).strftime(RESULTS_PREFIX_FORMAT)
+    raise Exception(f"Can't tell when {current.location} was run, so pass its results prefix with --current-prefix")
+
+
+# Keyed by (method, name) like Locust's own stats, with the aggregated row as ('', 'Aggregated')
+def read_stats(source):
+    stats = {}
+    for row in read_csv(source, STATS_FILE):
+        stats[(row['Type'], row['Name'])] = GroupingStats(
+            requests=int(row['Request Count']),
+            failures=int(row['Failure Count']),
+            requests_per_second=float(row['Requests/s']),
+            percentiles={percent: _number(row.get(f"{percent}%")) for percent in LOCUST_PERCENTILES})
+    return stats
+
+
+def read_history(source):
+    if source.find(STATS_HISTORY_FILE) is None:
+        logger.warning("No %s in %s", STATS_HISTORY_FILE, source.location)
+        return RunSummary(0, 0, 0)
+    rows = [row for row in read_csv(source, STATS_HISTORY_FILE) if row['Name'] == 'Aggregated']
+    if not rows:
+        return RunSummary(0, 0, 0)
+    return RunSummary(int(rows[-1]['Timestamp']) - int(rows[0]['Timestamp']),
+                      max(int(row['User Count']) for row in rows), int(rows[0]['Timestamp']))
+
+
+def read_csv(source, name):
+    file_name = source.find(name)
+    if file_name is None:
+        raise Exception(f"No {name} in {source.location}")
+    content = source.read(file_name)
+    if file_name.endswith('.gz'):
+        content = gzip.decompress(content)
+    return list(csv.DictReader(io.StringIO(content.decode('utf-8'))))
+
+
+def compare(current, baseline, args):
+    comparisons = []
+    for key in sorted(baseline.keys() - current.keys()):
+        logger.warning("%s %s is in the baseline but not the current run", *key)
+
+    for (method, name) in sorted(current.keys() & baseline.keys()):
+        now, then = current[(method, name)], baseline[(method, name)]
+        judged = min(now.requests, then.requests) >= args.min_requests
+
+        for percent in COMPARED_PERCENTILES:
+            if now.percentiles[percent] is None or then.percentiles[percent] is None:
+                continue
+            change = _relative_change(then.percentiles[percent], now.percentiles[percent])
+            p_value = quantile_shift_p_value(now, then, percent)
+            comparisons.append(Comparison(method, name, f"p{percent}", then.percentiles[percent],
+                                          now.percentiles[percent], change, p_value,
+                                          judged and change > args.latency_threshold and p_value < args.alpha))
+
+        change = _relative_change(then.requests_per_second, now.requests_per_second)
+        p_value = rate_drop_p_value(now, then)
+        comparisons.append(Comparison(method, name, "requests/s", round(then.requests_per_second, 2),
+                                      round(now.requests_per_second, 2), change, p_value,
+                                      judged and -change > args.throughput_threshold and p_value < args.alpha))
+
+        then_rate = then.failures / then.requests if then.requests else 0
+        now_rate = now.failures / now.requests if now.requests else 0
+        p_value = failure_rate_p_value(now, then)
+        comparisons.append(Comparison(method, name, "failure rate", round(then_rate, 4), round(now_rate, 4),
+                                      now_rate - then_rate, p_value,
+                                      judged and now_rate - then_rate > args.failure_rate_threshold
+                                      and p_value < args.alpha))
+    return comparisons
+
+
+# Only percentiles are kept, not every response time, so the test is whether more of the current run's requests are
+# slower than the baseline's percentile than the percentile allows for, reading that fraction off the current run's
+# percentiles by interpolating between them
+def quantile_shift_p_value(current, baseline, percent):
+    expected = 1 - percent / 100
+    if expected <= 0 or not current.requests or not baseline.requests:
+        return 1.0
+    slower = _fraction_slower(current.percentiles, baseline.percentiles[percent])
+    error = math.sqrt(expected * (1 - expected) * (1 / current.requests + 1 / baseline.requests))
+    return _upper_tail((slower - expected) / error)
+
+
+# Requests are treated as Poisson arrivals over each run's duration
+def rate_drop_p_value(current, baseline):
+    if not current.requests_per_second or not baseline.requests_per_second:
+        return 1.0
+    current_seconds = current.requests / current.requests_per_second
+    baseline_seconds = baseline.requests / baseline.requests_per_second
+    error = math.sqrt(current.requests / current_seconds ** 2 + baseline.requests / baseline_seconds ** 2)
+    return _upper_tail((baseline.requests_per_second - current.requests_per_second) / error)
+
+
+def failure_rate_p_value(current, baseline):
+    if not current.requests or not baseline.requests:
+        return 1.0
+    pooled = (current.failures + baseline.failures) / (current.requests + baseline.requests)
+    error = math.sqrt(pooled * (1 - pooled) * (1 / current.requests + 1 / baseline.requests))
+    if not error:
+        return 1.0
+    return _upper_tail((current.failures / current.requests - baseline.failures / baseline.requests) / error)
+
+
+def print_comparisons(comparisons):
+    print(f"{'Type':<6} {'Name':<50} {'Metric':<13} {'Baseline':>10} {'Current':>10} {'Change':>8} {'p':>7}")
+    for comparison in comparisons:
+        print(f"{comparison.method:<6} {comparison.name[:50]:<50} {comparison.metric:<13} {comparison.baseline:>10} "
+              f"{comparison.current:>10} {comparison.change:>+8.1%} {comparison.p_value:>7.4f}"
+              f"{'  REGRESSION' if comparison.regression else ''}")
+
+
+def write_comparisons(file_name, comparisons):
+    with open(file_name, 'w', newline='') as comparison_file:
+        writer = csv.writer(comparison_file)
+        writer.writerow(['Type', 'Name', 'Metric', 'Baseline', 'Current', 'Change', 'p-value', 'Regression'])
+        for comparison in comparisons:
+            writer.writerow([comparison.method, comparison.name, comparison.metric, comparison.baseline,
+                             comparison.current, round(comparison.change, 4), round(comparison.p_value, 6),
+                             comparison.regression])
+
+
+# Results in a directory, laid out the way Locust writes them or the 'local' results backend stores them
+class LocalResults:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.location = directory
+        self.prefix = os.path.basename(os.path.abspath(directory))
+
+    def find(self, name):
+        return next((file_name for file_name in (name, name + '.gz')
+                     if os.path.isfile(os.path.join(self.directory, file_name))), None)
+
+    def read(self, file_name):
+        with open(os.path.join(self.directory, file_name), 'rb') as results_file:
+            return results_file.read()
+
+    def prefixes(self):
+        return [entry.name for entry in os.scandir(self.directory) if entry.is_dir()]
+
+    def child(self, prefix):
+        return LocalResults(os.path.join(self.directory, prefix))
+
+
+class BucketResults:
+
+    def __init__(self, bucket_name, prefix, client=None):
+        # Only imported when a bucket is used, so comparing local results doesn't need the client library
+        from google.cloud import storage
+        self.client = client or storage.Client(project=os.getenv('GOOGLE_CLOUD_PROJECT'))
+        self.bucket = self.client.bucket(bucket_name)
+        self.prefix = prefix
+        self.location = f"gs://{bucket_name}/{prefix}"
+
+    def find(self, name):
+        return next((file_name for file_name in (name, name + '.gz')
+                     if self.bucket.get_blob(self._path(file_name)) is not None), None)
+
+    def read(self, file_name):
+        return self.bucket.blob(self._path(file_name)).download_as_bytes()
+
+    def prefixes(self):
+        blobs = self.client.list_blobs(self.bucket, prefix=self._path(''), delimiter='/')
+        for _ in blobs:
+            pass
+        return [prefix[len(self._path('')):].rstrip('/') for prefix in blobs.prefixes]
+
+    def child(self, prefix):
+        return BucketResults(self.bucket.name, self._path(prefix), self.client)
+
+    def _path(self, name):
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+
+def _fraction_slower(percentiles, threshold):
+    below_value, below_fraction = 0, 0
+    for percent, value in sorted(percentiles.items()):
+        if value is None:
+            continue
+        if value > threshold:
+            share = (threshold - below_value) / (value - below_value)
+            return 1 - (below_fraction + (percent / 100 - below_fraction) * share)
+        below_value, below_fraction = value, percent / 100
+    return 0.0
+
+
+def _prefix_time(prefix):
+    return prefix[:len('yy-mm-dd-HH-MM')]
+
+
+def _number(value):
+    return None if value in (None, '', 'N/A') else float(value)
+
+
+def _relative_change(baseline, current):
+    if baseline:
+        return (current - baseline) / baseline
+    return 0.0 if current == baseline else math.inf
+
+
+def _upper_tail(z):
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+if __name__ == '__main__':
+    sys.exit(main())